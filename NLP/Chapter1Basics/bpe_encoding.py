@@ -1,57 +1,173 @@
 from argparse import ArgumentParser
 import heapq
+import json
+import re
+from functools import lru_cache
+from typing import Iterable
+from collections import Counter, defaultdict
+
+def merge_pair(symbols: list, pair: tuple, merged: str) -> list:
+	"""Returns a word's symbols with every (left to right, non-overlapping) occurrence of a pair merged into one symbol"""
+	result = []
+	i = 0
+	while i < len(symbols):
+		if i < len(symbols) - 1 and symbols[i] == pair[0] and symbols[i+1] == pair[1]:
+			result.append(merged)
+			i += 2
+		else:
+			result.append(symbols[i])
+			i += 1
+	return result
 
-def bpe_encoding(document: str, k: int = 10):
-	"""Takes a filename, returns bpe encoding (Chapter 1 Jurafsky Pg. 19)"""
-	# reading in file
-	with open(document, 'r') as file_reader:
-		doc_as_string = file_reader.read()
-		string_by_char = [char for char in doc_as_string]
-
-	# to keep track of groupings
-	groupings = []
-
-	for i in range(k):
-		# obtaining vocabulary as set
-		vocab = set(string_by_char)
-		adj_pairs_counts = {}
-		adj_pairs_heap = []
 
-		# maintaining counts of adjacent pairs
-		for i in range(len(string_by_char) - 2):
-			pair = string_by_char[i] + string_by_char[i+1]
+def train_bpe(text: str, k: int = 10) -> list:
+	"""
+	Learns up to k BPE merges from a text (Chapter 1 Jurafsky Pg. 19), working on a word frequency table.
+	Keeps a pair -> count map and a pair -> words index, so each merge only revisits the words containing the merged pair,
+	and picks the most frequent pair from a heap whose stale entries are skipped when popped (lazy deletion).
 
-			# ensuring pairs added are only within a single word
-			if ' ' not in pair and '\n' not in pair:
-				# upddating counts and setting to 1 if not previously seen
-				adj_pairs_counts[pair] = adj_pairs_counts.get(pair, 0) + 1
+	args:
+		text: training text, split into words on whitespace so that merges never cross words
+		k: number of merges to learn
 
-		adj_pairs_heap = []
+	returns:
+		list of merged (left symbol, right symbol) pairs, in the order they were learned
+	"""
+	# every distinct word as a list of symbols (initially characters), with its frequency
+	word_counts = Counter(text.split())
+	words = [list(word) for word in word_counts]
+	freqs = list(word_counts.values())
+
+	# counts of adjacent pairs, weighted by word frequency, and the words each pair occurs in
+	pair_counts = defaultdict(int)
+	pair_words = defaultdict(set)
+	for idx, symbols in enumerate(words):
+		for pair in zip(symbols, symbols[1:]):
+			pair_counts[pair] += freqs[idx]
+			pair_words[pair].add(idx)
+
+	# max-heap of pairs by count, ties broken by the merged string
+	heap = [(-count, pair[0] + pair[1], pair) for pair, count in pair_counts.items()]
+	heapq.heapify(heap)
+
+	merges = []
+	while len(merges) < k and heap:
+		neg_count, merged, pair = heapq.heappop(heap)
+
+		# skipping entries whose count has changed since they were pushed
+		if pair_counts.get(pair, 0) != -neg_count:
+			continue
+		merges.append(pair)
+
+		# re-pairing only the words containing the merged pair, tracking how every pair count changes
+		deltas = defaultdict(int)
+		for idx in pair_words.pop(pair):
+			symbols, freq = words[idx], freqs[idx]
+			new_symbols = merge_pair(symbols, pair, merged)
+			if len(new_symbols) == len(symbols):
+				continue
+
+			for old_pair in zip(symbols, symbols[1:]):
+				deltas[old_pair] -= freq
+			for new_pair in zip(new_symbols, new_symbols[1:]):
+				deltas[new_pair] += freq
+				pair_words[new_pair].add(idx)
+			words[idx] = new_symbols
+
+		# applying the changes and pushing the new counts, older heap entries becoming stale
+		for changed_pair, delta in deltas.items():
+			if delta == 0:
+				continue
+			pair_counts[changed_pair] += delta
+			if pair_counts[changed_pair] > 0:
+				heapq.heappush(heap, (-pair_counts[changed_pair], changed_pair[0] + changed_pair[1], changed_pair))
+			else:
+				del pair_counts[changed_pair]
+				pair_words.pop(changed_pair, None)
+
+	return merges
 
-		# creating heap of adjacent pairs
-		for pair, count in adj_pairs_counts.items():
-			heapq.heappush(adj_pairs_heap, (-count, pair))
 
+def bpe_encoding(document: str, k: int = 10):
+	"""Takes a filename, returns bpe encoding (Chapter 1 Jurafsky Pg. 19) as the list of merged groupings"""
+	# reading in file
+	with open(document, 'r') as file_reader:
+		doc_as_string = file_reader.read()
 
-		# obtaining most frequent adjacent pair
-		most_freq_pair = adj_pairs_heap[0]
+	return [left + right for left, right in train_bpe(doc_as_string, k)]
 
-		# appending most frequent pair to list of groupings
-		groupings.append(most_freq_pair[1])
+class BPETokenizer:
+	"""
+	Applies learned BPE merges by rank: within each whitespace-separated word, the adjacent pair with the earliest learned merge
+	is merged first, until no learned pair remains. Word segmentations are memoized in a bounded LRU cache,
+	so the repeated words of a corpus are only segmented once.
+	"""
 
-		# resetting counter
-		c = 0
+	def __init__(self, merges: list, alphabet: Iterable[str] = (), cache_size: int = 100_000):
+		"""
+		args:
+			merges: list of (left symbol, right symbol) pairs, in the order they were learned (see train_bpe)
+			alphabet: single characters of the training text, given the first ids of the vocabulary
+			cache_size: maximum number of word segmentations to memoize
+		"""
+		self.merges = [tuple(pair) for pair in merges]
+		self.ranks = {pair: rank for rank, pair in enumerate(self.merges)}
+		self.cache_size = cache_size
+		self.encode_word = lru_cache(maxsize=cache_size)(self.segment_word)
+
+		# token -> id, characters first and then every merged symbol in the order it was learned
+		self.token_to_id = {}
+		for token in [*sorted(set(alphabet)), *(left + right for left, right in self.merges)]:
+			self.token_to_id.setdefault(token, len(self.token_to_id))
+
+	def save(self, path: str) -> None:
+		"""
+		Writes the ordered merge list and the vocabulary (tokens in id order) to a single json file, which load() reads back
+
+		args:
+			path: file to write the tokenizer to
+		"""
+		with open(path, 'w', encoding="utf-8") as tokenizer_writer:
+			json.dump({"merges": self.merges, "vocab": list(self.token_to_id)}, tokenizer_writer, ensure_ascii=False, separators=(",", ":"))
+
+	@classmethod
+	def load(cls, path: str, cache_size: int = 100_000) -> "BPETokenizer":
+		"""Rebuilds a tokenizer written by save(), without training again"""
+		with open(path, 'r', encoding="utf-8") as tokenizer_reader:
+			saved = json.load(tokenizer_reader)
+
+		tokenizer = cls(saved["merges"], cache_size=cache_size)
+		tokenizer.token_to_id = {token: token_id for token_id, token in enumerate(saved["vocab"])}
+		return tokenizer
+
+	def segment_word(self, word: str) -> tuple:
+		"""Splits a single word into its BPE symbols (uncached, see encode_word)"""
+		symbols = list(word)
+
+		while len(symbols) > 1:
+			# lowest ranked pair present in the word, if any pair was learned at all
+			pair = min(zip(symbols, symbols[1:]), key=lambda candidate: self.ranks.get(candidate, len(self.ranks)))
+			if pair not in self.ranks:
+				break
+			symbols = merge_pair(symbols, pair, pair[0] + pair[1])
+
+		return tuple(symbols)
+
+	def encode(self, text: str) -> list:
+		"""Tokenizes a text into BPE symbols, keeping every whitespace character as a token of its own"""
+		tokens = []
+		for piece in re.findall(r"\S+|\s", text):
+			tokens.extend(self.encode_word(piece) if not piece.isspace() else (piece,))
+		return tokens
+
+	def encode_many(self, texts: Iterable[str]) -> list:
+		"""Tokenizes a batch of texts, sharing the word cache between them"""
+		return [self.encode(text) for text in texts]
+
+	def encode_ids(self, text: str) -> list:
+		"""Tokenizes a text into vocabulary ids, -1 marking symbols missing from the vocabulary"""
+		return [self.token_to_id.get(token, -1) for token in self.encode(text)]
 
-		# merging most frequent pair and updating vocab
-		while c <= len(string_by_char) - 2:
-			# ie need to be merged, merging and updating
-			if string_by_char[c] + string_by_char[c+1] == most_freq_pair[1]:
-				string_by_char[c] = string_by_char[c] + string_by_char[c+1]
-				# deleting second character and updating vocab length
-				del string_by_char[c+1]
-			c += 1
-	# printing groupings
-	return groupings
 
 def tokenize_by_groupings(text: str, groupings: list, k: int) -> list:
 	"""
@@ -59,6 +175,7 @@ def tokenize_by_groupings(text: str, groupings: list, k: int) -> list:
 	"""
 	# Traverse through text and tokenize by groupings when possible
 	text_as_chars = [char for char in text]
+	groupings = set(groupings)
 
 	# k merges of any two found characters in the text
 	for i in range(k):
@@ -81,12 +198,26 @@ def tokenize_by_groupings(text: str, groupings: list, k: int) -> list:
 if __name__ == "__main__":
 	# obtaining arguments with argpase
 	parser = ArgumentParser("BPE Encoding", description="Computes BPE Encoding of a given document")
-	parser.add_argument("--document", type=str, help="Document to be encoded", required=True)
+	parser.add_argument("--document", type=str, help="Document to train BPE on", required=False)
 	parser.add_argument("-k", type=int, help="Number of iterations to run BPE", default=10, required=False)
 	parser.add_argument("-s", type=str, help="Input string to tokenize", default="Mary had a little lamb, wow what a world", required=False)
+	parser.add_argument("--save-tokenizer", type=str, help="File to write the trained merges and vocabulary to", default=None, required=False)
+	parser.add_argument("--load-tokenizer", type=str, help="File of a saved tokenizer to use instead of training", default=None, required=False)
+
+	args = parser.parse_args()
+	if args.load_tokenizer is None and args.document is None:
+		parser.error("one of --document or --load-tokenizer is required")
+
+	# reusing a saved tokenizer, or training one from the document
+	if args.load_tokenizer is not None:
+		tokenizer = BPETokenizer.load(args.load_tokenizer)
+	else:
+		with open(args.document, 'r') as file_reader:
+			doc_as_string = file_reader.read()
+		tokenizer = BPETokenizer(train_bpe(doc_as_string, args.k), alphabet=doc_as_string)
 
-	# argparse based bpe encoding
-	groupings = bpe_encoding(parser.parse_args().document, parser.parse_args().k)
+	if args.save_tokenizer is not None:
+		tokenizer.save(args.save_tokenizer)
 
 	# returning actual tokenization
-	print(tokenize_by_groupings(parser.parse_args().s, groupings, parser.parse_args().k))
+	print(tokenizer.encode(args.s))
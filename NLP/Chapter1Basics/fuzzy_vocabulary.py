@@ -0,0 +1,145 @@
+import argparse
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+from levenshtein_distance import levenshtein_distances
+
+# fixing path for the n-gram pipeline, whose tokenizer produces the out of vocabulary words this index corrects
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Chapter2NGrams"))
+from ngrams import read_corpus_chunks, stream_tokens
+
+
+def deletions(word: str, max_deletes: int) -> set:
+    """Every string obtained by deleting at most max_deletes characters of a word, the word itself included"""
+    variants = {word}
+    for num_deletes in range(1, min(max_deletes, len(word)) + 1):
+        for positions in combinations(range(len(word)), num_deletes):
+            deleted = set(positions)
+            variants.add("".join(char for index, char in enumerate(word) if index not in deleted))
+    return variants
+
+
+class FuzzyVocabulary:
+    """
+    SymSpell style deletion index over a vocabulary, mapping unknown words to their nearest known words.
+    Two words within edit distance d share a string reachable by at most d deletions from each (a substitution is a
+    deletion on both sides), so every word is indexed under its deletion variants once, and a query only verifies the
+    words sharing one of its own variants, with a single batched levenshtein computation, instead of scanning the lexicon.
+    """
+
+    def __init__(self, words: Iterable[str], max_distance: int = 2, subs_weight: float = 1):
+        """
+        args:
+            words: the known words, repeated words counting towards their frequency, which breaks ties between matches
+            max_distance: the largest edit distance queries may ask for
+            subs_weight: the weight of a substitution, at least 1 so that no distance within the bound needs more than
+                         max_distance deletions from either word
+        """
+        if subs_weight < 1:
+            raise ValueError("the deletion index only finds every match for substitution weights of at least 1")
+
+        self.max_distance = max_distance
+        self.subs_weight = subs_weight
+
+        frequencies = Counter(words)
+        self.words = list(frequencies)
+        self.frequencies = np.array([frequencies[word] for word in self.words], dtype=np.int64)
+
+        # deletion variant -> ids of the words it was derived from
+        self.index = defaultdict(list)
+        for word_id, word in enumerate(self.words):
+            for variant in deletions(word, max_distance):
+                self.index[variant].append(word_id)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def lookup(self, query: str, k: int = 1, max_distance: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Finds the k nearest known words of a query
+
+        args:
+            query: the word to look up
+            k: the number of matches to return
+            max_distance: the distance bound, at most the index's own (the default)
+
+        returns:
+            list of up to k (word, edit distance) pairs within the bound, nearest first and more frequent words first among ties
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+
+        candidates = set()
+        for variant in deletions(query, max_distance):
+            candidates.update(self.index.get(variant, ()))
+        if not candidates:
+            return []
+
+        # verifying every candidate in one vectorized computation
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        distances = levenshtein_distances(query, [self.words[word_id] for word_id in candidates], self.subs_weight)
+        within = distances <= max_distance
+        candidates, distances = candidates[within], distances[within]
+
+        best = np.lexsort((-self.frequencies[candidates], distances))[:k]
+        return [(self.words[word_id], float(distance)) for word_id, distance in zip(candidates[best], distances[best])]
+
+    def lookup_many(self, queries: Iterable[str], k: int = 1, max_distance: Optional[int] = None, workers: int = 1,
+                    batch_size: int = 1000) -> List[List[Tuple[str, float]]]:
+        """
+        Looks up a batch of queries, on a pool of processes when workers > 1. Every worker receives the index once,
+        and queries are sent in batches, so the per-query cost is the lookup alone
+
+        returns:
+            one lookup() result per query, in order
+        """
+        queries = list(queries)
+        if workers <= 1:
+            return [self.lookup(query, k, max_distance) for query in queries]
+
+        batches = [queries[start:start + batch_size] for start in range(0, len(queries), batch_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_index, initargs=(self,)) as executor:
+            results = executor.map(lookup_batch, batches, [k] * len(batches), [max_distance] * len(batches))
+            return [matches for batch_matches in results for matches in batch_matches]
+
+
+# the index a pool worker answers queries from, set once per process by set_worker_index
+worker_index = None
+
+
+def set_worker_index(index: FuzzyVocabulary) -> None:
+    """Pool initializer, keeping the index in the worker process"""
+    global worker_index
+    worker_index = index
+
+
+def lookup_batch(queries: List[str], k: int, max_distance: Optional[int]) -> List[List[Tuple[str, float]]]:
+    """Looks a batch of queries up in the worker's index"""
+    return [worker_index.lookup(query, k, max_distance) for query in queries]
+
+
+if __name__ == "__main__":
+    # obtaining arguments with argparse
+    parser = argparse.ArgumentParser("Fuzzy Vocabulary", description="Maps words to their nearest words in a vocabulary")
+    parser.add_argument("--vocab", type=str, help="Corpus whose words, tokenized like the n-gram corpus, form the vocabulary", required=True)
+    parser.add_argument("--queries", type=str, nargs="+", help="Words to look up", required=True)
+    parser.add_argument("-k", type=int, default=3, required=False, help="Number of matches per word")
+    parser.add_argument("--max-distance", type=int, default=2, required=False)
+    parser.add_argument("-s-weight", type=float, help="The weight of a substition", required=False, default=1)
+    parser.add_argument("--workers", type=int, default=1, required=False)
+    args = parser.parse_args()
+
+    # streaming the corpus through the n-gram tokenizer, so entries are lowercase and free of punctuation
+    fuzzy_vocab = FuzzyVocabulary((token for tokens in stream_tokens(read_corpus_chunks(args.vocab)) for token in tokens), args.max_distance, args.s_weight)
+
+    start = time.perf_counter()
+    all_matches = fuzzy_vocab.lookup_many(args.queries, args.k, workers=args.workers)
+    elapsed = time.perf_counter() - start
+
+    for query, matches in zip(args.queries, all_matches):
+        print(f"{query}: {matches}")
+    print(f"{len(args.queries) / elapsed:.0f} queries per second")
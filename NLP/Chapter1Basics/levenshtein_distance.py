@@ -1,42 +1,222 @@
 import argparse
-from typing import List
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
 import numpy as np
 
+# fixing path for the modules shared by the NLP chapters
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.instrumentation import add_instrumentation_arguments, count, instrumented, timed
 
-def levenshtein_distance(string1: str, string2: str, subs_weight:float) -> int:
+
+def to_codes(string: str) -> np.ndarray:
+    """Unicode code points of a string as an array, so characters compare in one vectorized operation"""
+    return np.frombuffer(string.encode("utf-32-le"), dtype=np.uint32)
+
+
+def edit_distance_row(codes1: np.ndarray, codes2: np.ndarray, subs_weight: float) -> np.ndarray:
+    """
+    Last row of the levenshtein DP table of two strings, computed one row at a time from a single rolling row
+
+    args:
+        codes1: code points of the string along the rows
+        codes2: code points of the string along the columns, or a (number of strings, length) matrix of several
+                strings padded to one length, whose rows are all computed at once
+        subs_weight: the weight of a substitution
+
+    returns:
+        float array whose entry j (along the last axis) is the edit distance between codes1 and the first j characters of codes2
+    """
+    offsets = np.arange(codes2.shape[-1] + 1, dtype=np.float64)
+    row = np.broadcast_to(offsets, codes2.shape[:-1] + offsets.shape).copy()
+
+    for i, code in enumerate(codes1, start=1):
+        # best of deleting codes1[i-1] or aligning it with (matching or substituting) every character of codes2
+        candidates = np.empty_like(row)
+        candidates[..., 0] = i
+        np.minimum(row[..., 1:] + 1, row[..., :-1] + np.where(codes2 == code, 0, subs_weight), out=candidates[..., 1:])
+
+        # insertions chain along the row, row[j] = min over k <= j of candidates[k] + (j - k), a running minimum
+        row = np.minimum.accumulate(candidates - offsets, axis=-1) + offsets
+
+    return row
+
+
+@timed()
+def levenshtein_distances(string: str, strings: List[str], subs_weight: float = 1) -> np.ndarray:
+    """
+    Edit distances between one string and each of many, computed together: the strings are padded into one matrix
+    and every DP row of all of them is a single vectorized step. Padding never affects a distance, as column j
+    of a row only depends on the columns before it
+
+    returns:
+        float array of one distance per string
     """
-    A DP Style soltuion for levenshtein edit distance
+    lengths = np.array([len(other) for other in strings], dtype=np.int64)
+    padded = np.zeros((len(strings), max(lengths.max(initial=0), 1)), dtype=np.uint32)
+    for index, other in enumerate(strings):
+        padded[index, :len(other)] = to_codes(other)
+
+    rows = edit_distance_row(to_codes(string), padded, subs_weight)
+    return rows[np.arange(len(strings)), lengths]
+
+
+def edit_distance_band(codes1: np.ndarray, codes2: np.ndarray, subs_weight: float, max_distance: float) -> float:
+    """
+    Ukkonen style bounded edit distance: every insertion or deletion costs 1, so a cell more than max_distance off the
+    main diagonal already exceeds the bound and only the band of width 2 * max_distance + 1 is evaluated.
+    Stops as soon as a whole band row exceeds the bound, making near-duplicate checks O(max_distance * n)
+
+    args:
+        codes1: code points of the string along the rows
+        codes2: code points of the string along the columns
+        subs_weight: the weight of a substitution
+        max_distance: the distance bound
+
+    returns:
+        the edit distance if it is at most max_distance, else infinity
     """
-    # two pronged array with strings as indices
-    table = np.zeros((len(string1), len(string2)))
-    
-    # iterating through dp table and populating entries
-    for i in range(table.shape[0]):
-        for j in range(table.shape[1]):
+    # no cell lies further off the diagonal than the longer string's length, whatever the bound (even infinite)
+    width = int(min(max_distance, max(len(codes1), len(codes2))))
+    if abs(len(codes1) - len(codes2)) > width:
+        count("banded early exits")
+        return np.inf
 
-            # special case where cannot rely on predecessor, so must evaluate match. Best option is either subs or deletion+insertion
-            if i == 0 and j == 0:
-                table[i][j] = 0 if string1[i] == string2[j] else min(subs_weight, 2)
-            
-            # otherwise, checking best path from a predecessor
-            else:
-                # if common char, don't need to use a formal substitution to make transition
-                if string1[i] == string2[j]:
-                    # maintaining sub cost
-                    subs_cost = table[i-1, j-1] if i > 0 and j > 0 else np.infty
-                else:
-                    subs_cost = table[i-1, j-1] + subs_weight if i > 0 and j > 0 else np.infty
+    # band[k] holds the cell of column j = i - width + k of the current row i
+    offsets = np.arange(2 * width + 1, dtype=np.float64)
+    columns = offsets.astype(np.int64) - width
+    band = np.where((columns >= 0) & (columns <= len(codes2)), columns, np.inf)
 
-                # computing min addition, subtraction cost
-                del_cost = table[i-1, j] + 1 if i > 0 else np.infty
-                add_cost = table[i, j-1] + 1 if j > 0 else np.infty
+    for i, code in enumerate(codes1, start=1):
+        columns += 1
+        valid = (columns >= 0) & (columns <= len(codes2))
 
-                # updating table with the minimum of all three costs
-                table[i,j] = min(subs_cost, del_cost, add_cost)
+        # substitutions come from the same band slot of the previous row, deletions from the slot to its right
+        mismatch = codes2[np.clip(columns - 1, 0, max(len(codes2) - 1, 0))] != code if len(codes2) else np.ones(len(columns), dtype=bool)
+        candidates = np.where(columns >= 1, band + np.where(mismatch, subs_weight, 0), np.inf)
+        np.minimum(candidates[:-1], band[1:] + 1, out=candidates[:-1])
+        candidates[~valid] = np.inf
 
-    # returning final entry
-    print(table)
-    return table[-1][-1]
+        # insertions chain along the row as a running minimum, as in edit_distance_row
+        band = np.minimum.accumulate(candidates - offsets) + offsets
+        band[~valid] = np.inf
+
+        if band.min() > max_distance:
+            count("banded early exits")
+            return np.inf
+
+    distance = band[len(codes2) - len(codes1) + width]
+    return float(distance) if distance <= max_distance else np.inf
+
+
+def align_full_table(codes1: np.ndarray, codes2: np.ndarray, subs_weight: float) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Alignment of two short strings by tracing back through their full DP table, as pairs of aligned code points (None for a gap).
+    The table is filled with the plain recurrence, so every cell equals exactly one of the sums the traceback compares it with
+    (the vectorized rows shift by offsets and back, which rounds fractional weights)
+    """
+    table = np.zeros((len(codes1) + 1, len(codes2) + 1))
+    table[:, 0] = np.arange(len(codes1) + 1)
+    table[0, :] = np.arange(len(codes2) + 1)
+    for i in range(1, len(codes1) + 1):
+        for j in range(1, len(codes2) + 1):
+            subs_cost = table[i - 1, j - 1] + (0 if codes1[i - 1] == codes2[j - 1] else subs_weight)
+            table[i, j] = min(subs_cost, table[i - 1, j] + 1, table[i, j - 1] + 1)
+
+    # walking back from the final entry along any predecessor that produced it
+    alignment = []
+    i, j = len(codes1), len(codes2)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and table[i, j] == table[i - 1, j - 1] + (0 if codes1[i - 1] == codes2[j - 1] else subs_weight):
+            alignment.append((codes1[i - 1], codes2[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and table[i, j] == table[i - 1, j] + 1:
+            alignment.append((codes1[i - 1], None))
+            i -= 1
+        else:
+            alignment.append((None, codes2[j - 1]))
+            j -= 1
+
+    return alignment[::-1]
+
+
+def align(codes1: np.ndarray, codes2: np.ndarray, subs_weight: float) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Hirschberg's divide and conquer alignment: splits codes1 in half, finds where an optimal path crosses the split
+    from the forward and reversed DP rows, and recurses on both halves, so memory stays linear in the string lengths
+    """
+    if len(codes1) <= 1 or len(codes2) == 0:
+        return align_full_table(codes1, codes2, subs_weight)
+
+    middle = len(codes1) // 2
+    forward = edit_distance_row(codes1[:middle], codes2, subs_weight)
+    backward = edit_distance_row(codes1[middle:][::-1], codes2[::-1], subs_weight)[::-1]
+    split = int(np.argmin(forward + backward))
+
+    return align(codes1[:middle], codes2[:split], subs_weight) + align(codes1[middle:], codes2[split:], subs_weight)
+
+
+@timed()
+def levenshtein_distance(string1: str, string2: str, subs_weight: float = 1, return_alignment: bool = False, max_distance: Optional[float] = None):
+    """
+    A DP Style solution for levenshtein edit distance, insertions and deletions costing 1 and substitutions subs_weight.
+    Rows are vectorized and only one is kept at a time, along the shorter string, so memory is O(min(m, n)).
+    Given a max_distance, only the diagonal band that can stay within it is evaluated (see edit_distance_band)
+
+    args:
+        string1: first string
+        string2: second string
+        subs_weight: the weight of a substitution
+        return_alignment: whether to also return an optimal alignment
+        max_distance: optional bound, distances above which are reported as infinity
+
+    returns:
+        the edit distance, or (edit distance, alignment) where the alignment is a list of aligned
+        (string1 character, string2 character) pairs, None marking an inserted or deleted character
+        (the alignment is None when the distance exceeds max_distance)
+    """
+    codes1, codes2 = to_codes(string1), to_codes(string2)
+
+    if max_distance is not None:
+        # the band is as wide for either string along the rows, so the shorter one is iterated
+        distance = edit_distance_band(*sorted([codes1, codes2], key=len), subs_weight, max_distance)
+        if not return_alignment or distance == np.inf:
+            return (distance, None) if return_alignment else distance
+
+    # insertions and deletions cost the same, so the distance is symmetric and the shorter string can run along the row
+    distance = float(edit_distance_row(*sorted([codes1, codes2], key=len, reverse=True), subs_weight)[-1])
+    if not return_alignment:
+        return distance
+
+    alignment = [(chr(code1) if code1 is not None else None, chr(code2) if code2 is not None else None)
+                 for code1, code2 in align(codes1, codes2, subs_weight)]
+    return distance, alignment
+
+
+def levenshtein_distance_loops(string1: str, string2: str, subs_weight: float = 1) -> float:
+    """The same distance filled into a full table with a python double loop, kept as the baseline for benchmarking"""
+    table = np.zeros((len(string1) + 1, len(string2) + 1))
+    table[:, 0] = np.arange(len(string1) + 1)
+    table[0, :] = np.arange(len(string2) + 1)
+
+    for i in range(1, len(string1) + 1):
+        for j in range(1, len(string2) + 1):
+            subs_cost = table[i - 1, j - 1] + (0 if string1[i - 1] == string2[j - 1] else subs_weight)
+            table[i, j] = min(subs_cost, table[i - 1, j] + 1, table[i, j - 1] + 1)
+
+    return float(table[-1, -1])
+
+
+def benchmark(length: int, subs_weight: float, seed: int = 0) -> None:
+    """Times the vectorized distance against the double loop on two random strings of a given length"""
+    rng = np.random.default_rng(seed)
+    string1, string2 = ("".join(rng.choice(list("abcdefghij"), size=length)) for _ in range(2))
+
+    for name, function in [("vectorized rows", levenshtein_distance), ("python double loop", levenshtein_distance_loops)]:
+        start = time.perf_counter()
+        distance = function(string1, string2, subs_weight)
+        print(f"{name}: distance {distance} in {time.perf_counter() - start:.3f}s")
 
 
 if __name__ == "__main__":
@@ -45,9 +225,22 @@ if __name__ == "__main__":
     parser.add_argument("-s1", type=str, help="First string", required=False, default="Mary had a little lamb")
     parser.add_argument("-s2", type=str, help="Second string", required=False, default="Mary had a large lamb, wow what a world")
     parser.add_argument("-s-weight", type=float, help="The weight of a substition", required=False, default=1)
+    parser.add_argument("--alignment", action="store_true", help="Also print an optimal alignment of the strings")
+    parser.add_argument("--max-distance", type=float, default=None, required=False, help="Only compute distances up to this bound")
+    parser.add_argument("--benchmark", type=int, default=None, required=False, help="Time against the double loop on random strings of this length instead")
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
 
-    # printing Levenshtein distance
-    print(levenshtein_distance(args.s1, args.s2, args.s_weight))
-
+    with instrumented(args):
+        if args.benchmark is not None:
+            benchmark(args.benchmark, args.s_weight)
 
+        # printing Levenshtein distance
+        elif args.alignment:
+            distance, alignment = levenshtein_distance(args.s1, args.s2, args.s_weight, return_alignment=True, max_distance=args.max_distance)
+            print(distance)
+            if alignment is not None:
+                print("".join(char1 or "-" for char1, _ in alignment))
+                print("".join(char2 or "-" for _, char2 in alignment))
+        else:
+            print(levenshtein_distance(args.s1, args.s2, args.s_weight, max_distance=args.max_distance))
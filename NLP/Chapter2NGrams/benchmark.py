@@ -0,0 +1,148 @@
+# Benchmark harness for the n-gram pipeline: trains on synthetic zipf-distributed corpora of growing size
+# and records training time, scoring throughput, prediction latency, sampling speed and peak memory as JSON
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from ngrams import NGramModel, read_corpus_chunks
+
+
+def write_zipf_corpus(path: str, num_tokens: int, vocab_size: int, exponent: float, rng: np.random.Generator, chunk_tokens: int = 1_000_000) -> None:
+    """
+    Writes a synthetic corpus of words w0, w1, ... whose frequencies follow a zipf law, generated in chunks to bound memory
+
+    args:
+        path: file to write the corpus to
+        num_tokens: number of tokens in the corpus
+        vocab_size: number of distinct words
+        exponent: exponent of the zipf distribution (> 1)
+        rng: numpy random generator
+        chunk_tokens: number of tokens generated and written at a time
+    """
+    with open(path, 'w') as corpus_writer:
+        for start in range(0, num_tokens, chunk_tokens):
+            ids = (rng.zipf(exponent, size=min(chunk_tokens, num_tokens - start)) - 1) % vocab_size
+            corpus_writer.write(" ".join(f"w{token_id}" for token_id in ids.tolist()) + "\n")
+
+
+def zipf_sentences(num_sentences: int, sentence_length: int, vocab_size: int, exponent: float, rng: np.random.Generator) -> list:
+    """Returns held-out sentences drawn from the same zipf distribution as the synthetic corpus"""
+    ids = (rng.zipf(exponent, size=(num_sentences, sentence_length)) - 1) % vocab_size
+    return [" ".join(f"w{token_id}" for token_id in row) for row in ids.tolist()]
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """
+    Peak resident set size so far, in megabytes (linux reports kilobytes), of this process or with RUSAGE_CHILDREN
+    of its largest waited-for child process (the counting workers). Both are lifetime peaks, see run_in_process
+    """
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def git_commit() -> str:
+    """Commit the benchmark runs on, so results of different commits can be compared"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def benchmark_model(corpus_path: str, n: int, sentences: list, num_predictions: int, num_samples: int, workers: int, trace_memory: bool, rng: np.random.Generator) -> dict:
+    """
+    Benchmarks every stage of the pipeline for one corpus and n-gram size
+
+    returns:
+        dictionary of measurements
+    """
+    result = {"n": n}
+
+    # training, streaming the corpus file
+    start = time.perf_counter()
+    model = NGramModel(read_corpus_chunks(corpus_path), n, seed=0, workers=workers)
+    result["train_seconds"] = time.perf_counter() - start
+    result["num_n_grams"] = int(len(model.keys[n]))
+    result["table_megabytes"] = sum(model.keys[order].nbytes + model.counts[order].nbytes for order in model.keys) / 2 ** 20
+
+    # peak traced memory of training, measured in a separate run as tracing slows it down
+    if trace_memory:
+        tracemalloc.start()
+        NGramModel(read_corpus_chunks(corpus_path), n, workers=workers)
+        result["train_peak_traced_megabytes"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    # batched scoring throughput
+    num_scored_tokens = sum(len(sentence.split(" ")) for sentence in sentences)
+    start = time.perf_counter()
+    model.score_sequences(sentences, orders=[n])
+    result["score_tokens_per_second"] = num_scored_tokens / (time.perf_counter() - start)
+
+    # next-word prediction latency, one call at a time
+    latencies = []
+    for sentence in rng.choice(sentences, size=num_predictions):
+        start = time.perf_counter()
+        model.get_next_word_prediction(sentence)
+        latencies.append(time.perf_counter() - start)
+    result["predict_p50_ms"] = float(np.percentile(latencies, 50) * 1000)
+    result["predict_p99_ms"] = float(np.percentile(latencies, 99) * 1000)
+
+    # sampling speed, backing off so dead-end contexts don't fall back to the unigram model
+    start = time.perf_counter()
+    sampled = model.sample_sentences(num_samples, backoff=True)
+    result["sample_tokens_per_second"] = sum(len(sentence.split(" ")) for sentence in sampled) / (time.perf_counter() - start)
+
+    result["peak_rss_megabytes"] = peak_rss_mb()
+    result["children_peak_rss_megabytes"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+
+def run_in_process(*args) -> dict:
+    """
+    Runs benchmark_model in a fresh process, so its peak memory covers this run alone
+    rather than the largest run so far in the harness
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(benchmark_model, *args).result()
+
+
+if __name__ == "__main__":
+    # obtaining arguments with argparse
+    parser = argparse.ArgumentParser("N-gram benchmark", description="Times the n-gram pipeline on synthetic zipf corpora of growing size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000], help="corpus sizes in tokens (up to 100M)")
+    parser.add_argument("--n-grams", type=int, nargs="+", default=[1, 2, 3, 4], help="n-gram sizes to benchmark")
+    parser.add_argument("--vocab-size", type=int, default=50_000, required=False)
+    parser.add_argument("--zipf-exponent", type=float, default=1.2, required=False)
+    parser.add_argument("--num-sentences", type=int, default=2_000, required=False, help="held-out sentences scored per run")
+    parser.add_argument("--num-predictions", type=int, default=1_000, required=False, help="next-word predictions timed per run")
+    parser.add_argument("--num-samples", type=int, default=200, required=False, help="sentences sampled per run")
+    parser.add_argument("--workers", type=int, default=1, required=False)
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced-memory training runs")
+    parser.add_argument("--seed", type=int, default=0, required=False)
+    parser.add_argument("--output", type=str, default="bench_results.json", required=False)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sentences = zipf_sentences(args.num_sentences, 20, args.vocab_size, args.zipf_exponent, rng)
+    results = {"commit": git_commit(), "settings": vars(args), "runs": []}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            corpus_path = os.path.join(tmp_dir, f"zipf_{size}.txt")
+            write_zipf_corpus(corpus_path, size, args.vocab_size, args.zipf_exponent, rng)
+
+            for n in args.n_grams:
+                run = {"num_tokens": size, **run_in_process(corpus_path, n, sentences, args.num_predictions, args.num_samples, args.workers, not args.no_memory, rng)}
+                results["runs"].append(run)
+                print(json.dumps(run))
+
+            os.remove(corpus_path)
+
+    with open(args.output, 'w') as results_writer:
+        json.dump(results, results_writer, indent=2)
+    print(f"results written to {args.output}")
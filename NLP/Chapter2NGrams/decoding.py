@@ -0,0 +1,177 @@
+# Decoding strategies on top of the counts of an NGramModel: beam search, and top-k / top-p sampling
+# of many sentences at once, all reading from candidate lists computed once per context
+import argparse
+import numpy as np
+from collections import defaultdict
+from functools import lru_cache
+from typing import Optional
+from ngrams import NGramModel, read_corpus_chunks, tokenize
+from utils.instrumentation import add_instrumentation_arguments, count, instrumented, timed  # on the path ngrams sets up
+
+
+class Candidates:
+    """The words that may follow a context, most likely first, with their probabilities and cumulative probabilities"""
+
+    def __init__(self, ids: np.ndarray, probabilities: np.ndarray):
+        order = np.argsort(-probabilities, kind="stable")
+        self.ids = ids[order]
+        self.probabilities = probabilities[order]
+        self.log_probabilities = np.log(self.probabilities)
+        self.cum_probabilities = np.cumsum(self.probabilities)
+
+    def truncate(self, top_k: Optional[int] = None, top_p: Optional[float] = None) -> "Candidates":
+        """
+        Keeps the k most likely words and/or the smallest set of most likely words whose probability reaches p.
+        Probabilities are left unnormalized, samplers scale draws by the total kept. The kept arrays are copies,
+        so caching a truncation does not keep the full list alive
+        """
+        keep = len(self.ids)
+        if top_k is not None:
+            keep = min(keep, top_k)
+        if top_p is not None:
+            keep = min(keep, int(np.searchsorted(self.cum_probabilities, top_p * self.cum_probabilities[-1])) + 1)
+
+        truncated = Candidates.__new__(Candidates)
+        truncated.ids, truncated.probabilities = self.ids[:keep].copy(), self.probabilities[:keep].copy()
+        truncated.log_probabilities, truncated.cum_probabilities = self.log_probabilities[:keep].copy(), self.cum_probabilities[:keep].copy()
+        return truncated
+
+
+class Decoder:
+    """
+    Generates text from an NGramModel. Candidate lists are built once per context (the last n-1 words, backing off to shorter
+    contexts when unseen) and kept with their truncations in an LRU cache of the most recently used contexts, so generating
+    many completions costs about as much as one. A smoothed model's full lists span the whole vocabulary, so for it only
+    truncated lists are cached
+    """
+
+    def __init__(self, model: NGramModel, cache_size: int = 4096):
+        """
+        args:
+            model: the model to decode from, its smoothed estimates when it has a smoother and its continuation counts otherwise
+            cache_size: number of most recently used (context, top_k, top_p) candidate lists kept
+        """
+        self.model = model
+        self.cached_candidates = lru_cache(maxsize=cache_size)(self.build_candidates)
+
+    def context_of(self, words: list) -> tuple:
+        """The part of a sentence the next word depends on"""
+        return tuple(words[max(0, len(words) - self.model.n + 1):]) if self.model.n > 1 else ()
+
+    def candidates(self, context: tuple, top_k: Optional[int] = None, top_p: Optional[float] = None) -> Candidates:
+        """Returns the (truncated) candidate list of a context, from the cache unless it is a smoothed model's full list"""
+        if self.model.smoother is not None and top_k is None and top_p is None:
+            return self.build_candidates(context)
+        return self.cached_candidates(context, top_k, top_p)
+
+    def build_candidates(self, context: tuple, top_k: Optional[int] = None, top_p: Optional[float] = None) -> Candidates:
+        """Builds the candidate list of candidates(), truncating a count model's cached full list"""
+        if top_k is not None or top_p is not None:
+            full = self.build_candidates(context) if self.model.smoother is not None else self.cached_candidates(context, None, None)
+            return full.truncate(top_k, top_p)
+
+        count("candidate lists built")
+        if self.model.smoother is not None:
+            probabilities = self.model.get_word_probabilities(list(context))
+            return Candidates(np.arange(len(probabilities)), probabilities)
+
+        order, _, start, end = self.model.find_context(list(context))
+        counts = self.model.counts[order][start:end]
+        return Candidates(self.model.keys[order][start:end] % len(self.model.vocab), counts / counts.sum())
+
+    @timed()
+    def beam_search(self, prefix: str, beam_width: int = 5, max_length: int = 20) -> list:
+        """
+        Finds the most likely continuations of a prefix, keeping the beam_width best partial sentences at every step
+
+        args:
+            prefix: string of words to continue, preprocessed like the corpus
+            beam_width: number of partial sentences kept
+            max_length: number of words to add
+
+        returns:
+            list of up to beam_width (sentence, log probability of the added words) pairs, most likely first
+        """
+        beams, scores = [tokenize(prefix)], np.zeros(1)
+
+        for _ in range(max_length):
+            # a beam's best extensions are among its candidates' first beam_width, which come sorted
+            extensions = [self.candidates(self.context_of(words), top_k=beam_width) for words in beams]
+            extension_scores = np.concatenate([score + candidates.log_probabilities for score, candidates in zip(scores, extensions)])
+            sources = np.repeat(np.arange(len(beams)), [len(candidates.ids) for candidates in extensions])
+            word_ids = np.concatenate([candidates.ids for candidates in extensions])
+
+            best = np.argsort(-extension_scores, kind="stable")[:beam_width]
+            beams = [beams[source] + [self.model.vocab.id_to_token[word_id]] for source, word_id in zip(sources[best], word_ids[best])]
+            scores = extension_scores[best]
+
+        return [(" ".join(words), float(score)) for words, score in zip(beams, scores)]
+
+    @timed()
+    def sample(self, prefixes: list, top_k: Optional[int] = None, top_p: Optional[float] = None, eos_prob: float = 0.05,
+               max_length: int = 50, rng: Optional[np.random.Generator] = None) -> list:
+        """
+        Samples a continuation of every prefix, advancing all unfinished sentences together one word per step.
+        Sentences sharing a context draw their next words in one batch from its candidate list
+
+        args:
+            prefixes: strings of words to continue, "" to start from the unigram distribution
+            top_k: sample only among the k most likely next words
+            top_p: sample only among the most likely next words covering a probability of p (nucleus sampling)
+            eos_prob: the probability of the sentence ending after every word, as in NGramModel.model_sample
+            max_length: largest number of words added to a prefix
+            rng: numpy random generator, the model's by default
+
+        returns:
+            list of sampled sentences, one per prefix
+        """
+        rng = rng if rng is not None else self.model.rng
+        sentences = [tokenize(prefix) for prefix in prefixes]
+        active = np.arange(len(sentences))
+
+        for _ in range(max_length):
+            if len(active) == 0:
+                break
+
+            # grouping the unfinished sentences by the context their next word depends on
+            groups = defaultdict(list)
+            for index in active.tolist():
+                groups[self.context_of(sentences[index])].append(index)
+
+            for context, indices in groups.items():
+                candidates = self.candidates(context, top_k, top_p)
+                draws = np.searchsorted(candidates.cum_probabilities, rng.random(len(indices)) * candidates.cum_probabilities[-1], side="right")
+                for index, word_id in zip(indices, candidates.ids[np.minimum(draws, len(candidates.ids) - 1)].tolist()):
+                    sentences[index].append(self.model.vocab.id_to_token[word_id])
+
+            # EOS decision for every sentence at once
+            active = active[rng.random(len(active)) > eos_prob]
+
+        return [" ".join(words) for words in sentences]
+
+
+if __name__ == "__main__":
+    # obtaining arguments with argparse
+    parser = argparse.ArgumentParser("N-gram decoding", description="Generates text from an n-gram model by beam search or top-k / top-p sampling")
+    parser.add_argument('--corpus', type=str, default='corpus.txt', required=False)
+    parser.add_argument('--load-model', type=str, default=None, required=False, help='directory of a saved model to load instead of training')
+    parser.add_argument('--n-gram', type=int, default=3, required=False)
+    parser.add_argument('--prefix', type=str, default='check this', required=False)
+    parser.add_argument('--beam-width', type=int, default=5, required=False)
+    parser.add_argument('--max-length', type=int, default=10, required=False)
+    parser.add_argument('--num-samples', type=int, default=5, required=False)
+    parser.add_argument('--top-k', type=int, default=None, required=False)
+    parser.add_argument('--top-p', type=float, default=None, required=False)
+    parser.add_argument('--seed', type=int, default=None, required=False)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented(args):
+        model = NGramModel.load(args.load_model, seed=args.seed) if args.load_model else NGramModel(read_corpus_chunks(args.corpus), args.n_gram, seed=args.seed)
+        decoder = Decoder(model)
+
+        for sentence, log_prob in decoder.beam_search(args.prefix, args.beam_width, args.max_length):
+            print(f"beam: {sentence} (log prob {log_prob:.3f})")
+
+        for sentence in decoder.sample([args.prefix] * args.num_samples, args.top_k, args.top_p, max_length=args.max_length):
+            print(f"sample: {sentence}")
@@ -1,4 +1,6 @@
-from ngrams import get_sequence_probability, get_next_word_prediction, preprocess_corpus, preprocess_sequence
+import argparse
+import math
+from ngrams import NGramModel, read_corpus_chunks, read_sentences
 
 # list of test corpuses to compute imperfect mle in intrinsic evaluation
 test_corpuses = {
@@ -8,21 +10,29 @@ test_corpuses = {
 "test_corpus_4": "A coin is a small object, usually round and flat, used primarily as a medium of exchange or legal tender. They are standardized in weight, and produced in large quantities at a mint in order to facilitate trade. They are most often issued by a government. Coins often have images, numerals, or text on them. The faces of coins or medals are sometimes called the obverse and the reverse, referring to the front and back sides, respectively. The obverse of a coin is commonly called heads, because it often depicts the head of a prominent person, and the reverse is known as tails. "
 }
 
-# train corpus
-with open('corpus.txt', 'r') as train_corpus:
-    train_corpus = train_corpus.read()
+# optionally evaluating a model saved by ngrams.py --save-model (trained with n >= 4) instead of training one
+parser = argparse.ArgumentParser()
+parser.add_argument('--model', type=str, default=None, required=False, help='directory of a saved model to load instead of training')
+parser.add_argument('--held-out', type=str, default=None, required=False, help='file of held-out sentences (one per line) to report perplexity on')
+args = parser.parse_args()
+
+# training one model holding counts for every order up to 4, streaming the train corpus
+model = NGramModel.load(args.model) if args.model else NGramModel(read_corpus_chunks('corpus.txt'), 4)
 
 # testing intrinsic evaluation - checking which model assigns higher likelihood to each of four reasonable sequences
-for sequence in test_corpuses.values():
+# every sequence is scored under every n in a single batched pass
+scores = model.score_sequences(test_corpuses.values(), orders=[1, 2, 3, 4])
+for idx, sequence in enumerate(test_corpuses.values()):
     for n in range(1, 5):
-        # getting counts dict
-        counts_dict = preprocess_corpus(train_corpus, n)
-        counts_dict_one_less = preprocess_corpus(train_corpus, n-1)
+        # displaying log probability and perplexity, based of sequence and model choice
+        log_prob, num_predictions = scores[n]["log_probs"][idx], scores[n]["num_predictions"][idx]
+        print(f"n: {n}, sequence: {sequence}, log prob: {log_prob}, perplexity: {math.exp(-log_prob / max(num_predictions, 1))}")
 
-        # displaying probability, based of sequence, counts dict, counts dict of prior, and model choice
-        seq_prob = max(5e-100, get_sequence_probability(sequence, counts_dict, counts_dict_one_less, n))
-        
-        print(f"n: {n}, sequence: {sequence}, prob: {seq_prob}, perplexity: {seq_prob**(-1/(len(sequence)-n+1))}")
+# perplexity of every n over a held-out set, streamed from file in batches
+if args.held_out:
+    held_out_scores = model.score_sequences(read_sentences(args.held_out), orders=[1, 2, 3, 4])
+    for n in range(1, 5):
+        print(f"n: {n}, held-out perplexity: {held_out_scores[n]['perplexity']}")
 
 
 # Conclusion: as n gets larger, the model is forced to multiply more and more probabilities,ß rendering the sequence unlikely. 
@@ -0,0 +1,86 @@
+# Load generator for server.py: keeps a number of requests in flight over several connections
+# and reports the throughput and latency percentiles of the server
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+from typing import Optional, Tuple
+from ngrams import read_sentences
+
+
+async def run_connection(requests: list, in_flight: int, host: str, port: int, unix_socket: Optional[str]) -> Tuple[list, int]:
+    """
+    Sends requests over one connection, keeping up to in_flight of them unanswered at a time
+
+    returns:
+        (list of the latency in seconds of every request, number of requests answered with an error)
+    """
+    if unix_socket is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    sent_at, latencies, num_errors = {}, [], 0
+    slots = asyncio.Semaphore(in_flight)
+
+    async def send() -> None:
+        for request_id, request in enumerate(requests):
+            await slots.acquire()
+            sent_at[request_id] = time.perf_counter()
+            writer.write((json.dumps({**request, "id": request_id}) + "\n").encode())
+            await writer.drain()
+
+    async def receive() -> None:
+        nonlocal num_errors
+        for _ in range(len(requests)):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent_at.pop(response["id"]))
+            num_errors += "error" in response
+            slots.release()
+
+    await asyncio.gather(send(), receive())
+    writer.close()
+    return latencies, num_errors
+
+
+async def generate_load(requests: list, connections: int, in_flight: int, host: str, port: int, unix_socket: Optional[str]) -> dict:
+    """Spreads requests over several connections and summarizes the server's requests/sec and latency percentiles"""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_connection(requests[index::connections], in_flight, host, port, unix_socket) for index in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate([connection_latencies for connection_latencies, _ in results]) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": sum(num_errors for _, num_errors in results),
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+if __name__ == "__main__":
+    # obtaining arguments with argparse
+    parser = argparse.ArgumentParser("N-gram load client", description="Measures the throughput and tail latency of server.py")
+    parser.add_argument('--sentences', type=str, default='corpus.txt', required=False, help='file whose lines are sent as sequences and prefixes')
+    parser.add_argument('--op', type=str, default='probability', required=False, choices=['probability', 'predict', 'sample'])
+    parser.add_argument('--requests', type=int, default=10_000, required=False)
+    parser.add_argument('--connections', type=int, default=8, required=False)
+    parser.add_argument('--in-flight', type=int, default=16, required=False, help='unanswered requests kept per connection')
+    parser.add_argument('--host', type=str, default='127.0.0.1', required=False)
+    parser.add_argument('--port', type=int, default=8765, required=False)
+    parser.add_argument('--unix-socket', type=str, default=None, required=False)
+    args = parser.parse_args()
+
+    # cycling through the lines of the file, sampling continuing only their first two words
+    lines = [line.strip() for line in read_sentences(args.sentences)]
+    texts = [lines[index % len(lines)] for index in range(args.requests)]
+    if args.op == 'sample':
+        requests = [{"op": "sample", "prefix": " ".join(text.split(" ")[:2]), "max_length": 20} for text in texts]
+    else:
+        requests = [{"op": args.op, "sequence": text} for text in texts]
+
+    print(json.dumps(asyncio.run(generate_load(requests, args.connections, args.in_flight, args.host, args.port, args.unix_socket))))
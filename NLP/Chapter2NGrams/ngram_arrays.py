@@ -0,0 +1,148 @@
+# Helpers for n-gram count tables held as sorted int64 key arrays, one table per order. The key of an n-gram is
+# row * V + last id, where row is the row of its context (its first n-1 ids) in the table one order down and V is
+# the vocabulary size, order 0 holding the empty context in row 0. Sorting the keys sorts the n-grams by their ids,
+# so all n-grams sharing a context are contiguous, and keys stay below (number of contexts) * V whatever the order
+import numpy as np
+
+
+def count_windows(ids: np.ndarray, n: int, base: int, skip: int = 0) -> tuple:
+    """
+    Counts the n-grams of every order 1..n of an id array into sorted tables, the rows of each order's windows
+    giving the contexts of the next order's. Windows lying within the first {skip} ids (the context carried from
+    earlier text) are kept with a count of 0, so every counted n-gram finds its context in the table below
+
+    args:
+        ids: int array of token ids
+        n: the largest n-gram size to count
+        base: the vocabulary size
+        skip: number of leading ids whose windows are not counted
+
+    returns:
+        (keys, counts) dictionaries from order to the sorted key array and the parallel count array of that order
+    """
+    keys, counts = {}, {}
+
+    # every window of order 0 is the empty context, row 0
+    rows = np.zeros(len(ids), dtype=np.int64)
+    for order in range(1, n + 1):
+        window_keys = rows[:max(len(ids) - order + 1, 0)] * base + ids[order - 1:]
+
+        # np.unique sorts the windows and gives the row of each, the context of the window one order up starting there
+        keys[order], rows = np.unique(window_keys, return_inverse=True)
+        counts[order] = np.bincount(rows[max(skip - order + 1, 0):], minlength=len(keys[order])).astype(np.int64)
+
+    return keys, counts
+
+
+def reparent(keys: np.ndarray, rows: np.ndarray, old_base: int, new_base: int, word_ids: np.ndarray = None) -> np.ndarray:
+    """
+    Re-encodes keys whose contexts moved to new rows, in a grown vocabulary size. Keys stay sorted as long as rows is
+    increasing and no word_ids are given
+
+    args:
+        keys: key array of one order
+        rows: the new row of every row of the table one order down
+        old_base: the vocabulary size the keys were made with
+        new_base: the vocabulary size to make them with
+        word_ids: the new id of every old id, if the words were renumbered
+
+    returns:
+        int64 array of the re-encoded keys
+    """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    contexts, words = np.divmod(keys, old_base)
+    return rows[contexts] * new_base + (words if word_ids is None else word_ids[words])
+
+
+def merge_counts(keys_a: np.ndarray, counts_a: np.ndarray, keys_b: np.ndarray, counts_b: np.ndarray) -> tuple:
+    """
+    Merges a count table into another of the same order and vocabulary size, summing the counts of shared keys.
+    The keys of b are binary searched in a and the missing ones inserted, so merging a small table into a large one
+    costs one pass over the large one
+
+    args:
+        keys_a: sorted array of unique keys
+        counts_a: array of their counts
+        keys_b: array of unique keys, in any order
+        counts_b: array of their counts
+
+    returns:
+        (keys, counts) of the merged sorted table, then the row of every key of a and of b in it
+    """
+    # a stable sort of keys which are already sorted (a chunk's table) is a single linear pass
+    ordering = np.argsort(keys_b, kind="stable")
+    sorted_b = keys_b[ordering]
+
+    positions = np.searchsorted(keys_a, sorted_b)
+    found = np.zeros(len(sorted_b), dtype=bool)
+    if len(keys_a):
+        found = keys_a[np.minimum(positions, len(keys_a) - 1)] == sorted_b
+
+    # the j-th missing key of b goes in front of the first larger key of a, j rows further down, and a fills the other rows
+    inserted_rows = positions[~found] + np.arange(np.count_nonzero(~found))
+    is_a = np.ones(len(keys_a) + len(inserted_rows), dtype=bool)
+    is_a[inserted_rows] = False
+    rows_a = np.flatnonzero(is_a)
+
+    keys = np.empty(len(is_a), dtype=np.int64)
+    keys[rows_a], keys[inserted_rows] = keys_a, sorted_b[~found]
+    counts = np.empty(len(is_a), dtype=np.int64)
+    counts[rows_a], counts[inserted_rows] = counts_a, counts_b[ordering[~found]]
+
+    # shared keys add their counts
+    rows_b = np.empty(len(keys_b), dtype=np.int64)
+    rows_b[ordering[found]] = rows_a[positions[found]]
+    rows_b[ordering[~found]] = inserted_rows
+    counts[rows_b[ordering[found]]] += counts_b[ordering[found]]
+    return keys, counts, rows_a, rows_b
+
+
+def prefix_rows(tables: dict, columns: np.ndarray, base: int) -> np.ndarray:
+    """
+    Finds the n-grams of an id matrix in sorted key tables, walking from the empty context one id at a time,
+    with one vectorized binary search per column
+
+    args:
+        tables: dictionary from order to the sorted key array of that order, from 0 up to the number of columns
+        columns: (number of n-grams, order) int array of token ids, -1 marking words missing from the vocabulary
+        base: the vocabulary size
+
+    returns:
+        (number of n-grams, order + 1) int64 array whose column j holds the row of every n-gram's first j ids
+        in tables[j], -1 from the first prefix which is not stored
+    """
+    rows = np.zeros((len(columns), columns.shape[1] + 1), dtype=np.int64)
+    for column in range(columns.shape[1]):
+        table = tables[column + 1]
+        if len(table) == 0:
+            rows[:, column + 1:] = -1
+            break
+
+        keys = rows[:, column] * base + columns[:, column]
+        positions = np.minimum(np.searchsorted(table, keys), len(table) - 1)
+        found = (rows[:, column] >= 0) & (columns[:, column] >= 0) & (table[positions] == keys)
+        rows[:, column + 1] = np.where(found, positions, -1)
+
+    return rows
+
+
+def gather(values: np.ndarray, rows: np.ndarray, default=0) -> np.ndarray:
+    """Values of many rows of a table, default for the rows -1 (not stored)"""
+    if len(values) == 0:
+        return np.full(len(rows), default, dtype=values.dtype)
+    return np.where(rows >= 0, values[np.maximum(rows, 0)], default)
+
+
+def suffix_rows(tables: dict, order: int, base: int) -> np.ndarray:
+    """
+    Row in tables[order - 1] of the suffix (every id but the first) of every n-gram of tables[order], built up from
+    the suffixes of their contexts. The suffix of a counted window is itself a counted window, so it is always stored
+    """
+    rows = np.zeros(len(tables[1]), dtype=np.int64)
+    for current in range(2, order + 1):
+        # the suffix of an n-gram is the suffix of its context extended by its last id
+        keys = tables[current]
+        rows = np.searchsorted(tables[current - 1], rows[keys // base] * base + keys % base)
+    return rows
@@ -1,8 +1,23 @@
 import argparse
+import json
+import logging
+import os
 import string
+import sys
 import math 
-import random
-from itertools import permutations
+import numpy as np
+from ngram_arrays import count_windows, reparent, merge_counts, prefix_rows, gather
+from smoothing import SMOOTHERS, AddKSmoother, Smoother
+from collections import Counter, deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Union
+
+# fixing path for the modules shared by the NLP chapters
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.instrumentation import add_instrumentation_arguments, count, instrumented, timed
+
+logger = logging.getLogger(__name__)
 
 
 def preprocess_sequence(sequence: str) -> str:
@@ -18,264 +33,694 @@ def preprocess_sequence(sequence: str) -> str:
     return sequence.lower().translate(str.maketrans('', '', string.punctuation)).replace('\n', ' ').strip()
 
 
-def sample(corpus_counts: dict) -> str:
-    """Samples a word"""
-    # building a cumulative probability range for every word
-    cum_probs = []
-    corresponding_words = []
-    curr_prob = 0
-    sum_corpus_counts = sum(corpus_counts.values())
-    for word, count in corpus_counts.items():
+def tokenize(sequence: str) -> list:
+    """Preprocesses a string and splits it into its words, dropping empty tokens"""
+    return preprocess_sequence(sequence).split()
+
+
+def read_corpus_chunks(path: str, chunk_size: int = 1 << 20) -> Iterator[str]:
+    """
+    Lazily reads a corpus file in fixed-size chunks of characters, so it never has to fit in memory at once
+
+    args:
+        path: path of the corpus file
+        chunk_size: number of characters per chunk
+
+    returns:
+        iterator over the chunks of the file
+    """
+    with open(path, 'r') as corpus_reader:
+        while chunk := corpus_reader.read(chunk_size):
+            yield chunk
 
-        # cummulative proability range creation, as dictated by word counts
-        cum_probs.append((curr_prob, curr_prob + count/sum_corpus_counts))
-        curr_prob += count/sum_corpus_counts
 
-        # appending corresponding word to probability range for the maintanence of consistency
-        corresponding_words.append(word)
+def read_sentences(path: str) -> Iterator[str]:
+    """Lazily reads the non-empty lines of a file, one sentence per line"""
+    with open(path, 'r') as sentence_reader:
+        for line in sentence_reader:
+            if line.strip():
+                yield line
 
-    # sampling a random number
-    rand_prob = random.randint(0,10_000)/10_000
 
-    # finding the word corresponding to the uniform probability
-    for idx, prob_range in enumerate(cum_probs):
-        if prob_range[0] <= rand_prob <= prob_range[1]:
-            return corresponding_words[idx]
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    """Groups an iterable into lists of at most {batch_size} consecutive items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
 
-    # if not found in given probability range   
-    return "the"
+    if batch:
+        yield batch
 
 
-def model_sample(corpus: str, n: int, eos_prob: float = 0.05, smoothing=False, backoff=False) -> str:
+def stream_tokens(chunks: Iterable[str]) -> Iterator[list]:
     """
-    Samples a random sentence from the n-gram language model.
+    Tokenizes a stream of text chunks incrementally, holding back a word cut by a chunk boundary until the next chunk
 
-    :param: corpus: the language model's corpus
-    :param: n: the n-gram model to use
-    :param eos_prob: the probability that the next token will be an end of sentence token (the sentence will end and the result will be returned)
+    args:
+        chunks: iterable of consecutive pieces of a corpus
 
-    :returns: a string, the sampled sentence
+    returns:
+        iterator over the token list of every chunk
     """
-    # if smoothing used, backoff will never be used
-    assert not (smoothing and backoff), "use of smoothing automatically implies backoff will never be used"
+    carry = ""
+    for chunk in chunks:
+        text = carry + chunk
 
-    # obtaining first word
-    corpus_counts_one_gram = preprocess_corpus(corpus=corpus, n_gram_size=1)
-    sen = sample(corpus_counts_one_gram)
+        # everything after the last whitespace may be the start of a word continued in the next chunk
+        boundary = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+        text, carry = text[:boundary + 1], text[boundary + 1:]
+        yield tokenize(text)
 
-    # boolean denoting whether constructed sentence should end and be returned
-    return_sentence = False
+    yield tokenize(carry)
 
-    # corpus counts dictionary
-    corpus_counts = {}
 
-    def n_gram_contains_context_at_beginning(context: str, n_gram: str) -> bool:
+class Vocabulary:
+    """Interns tokens as consecutive integer ids, so n-grams can be stored as arrays of ids rather than strings"""
+
+    def __init__(self, tokens: Optional[list] = None):
+        """
+        args:
+            tokens: optional tokens to add, in order of first appearance
         """
-        Tests if a potential n-gram evaluated as a viable extension of a context indeed
-        has that context in the beginning of the n-gram
+        self.token_to_id = {}
+        self.id_to_token = []
+
+        for token in tokens or []:
+            self.add(token)
+
+    def __len__(self) -> int:
+        return len(self.id_to_token)
 
-        :param context - a context string to be exteneded
-        :param n_gram - an n-gram to be evaluated to check if it contains the context
-        :param smoothing - boolean indicating whether or not to apply laplacian smoothing 
+    def __contains__(self, token: str) -> bool:
+        return token in self.token_to_id
 
-        :returns: a boolean denoting whether the n-gram contains the context at the beginning
+    def add(self, token: str) -> int:
+        """Returns the id of a token, assigning it the next id if unseen"""
+        token_id = self.token_to_id.get(token)
+        if token_id is None:
+            token_id = self.token_to_id[token] = len(self.id_to_token)
+            self.id_to_token.append(token)
+        return token_id
+
+    def encode(self, tokens: list, add: bool = False) -> np.ndarray:
         """
-        # attempting to find the index of the context, if at beginning return true,
-        # if not at beginning or not in n-gram at all return false
-        try:
-            return n_gram.index(context) == 0
-        except ValueError:
-            return False
+        Maps tokens to an int32 id array
 
+        args:
+            tokens: list of tokens
+            add: whether to add unseen tokens to the vocabulary, otherwise they are encoded as -1
 
-    # appending words repeatedly to first word
-    while not return_sentence:
-        # n-gram either set to value of n or using maximal context otherwise available
-        curr_n = min(n, len(sen.split(" "))+1)
-        
-        # rebuilding corpus counts if necessary (if previous n size was at unstable value, didn't utilize full n)
-        corpus_counts = preprocess_corpus(corpus, curr_n, smoothing=smoothing, smoothing_k = 0.1)
+        returns:
+            int32 array of token ids
+        """
+        lookup = self.add if add else (lambda token: self.token_to_id.get(token, -1))
+        return np.fromiter((lookup(token) for token in tokens), dtype=np.int32, count=len(tokens))
 
-        # filtering corpus by sequences with proper "context" getting only n-grams that have previous words as context
-        # only needed if n > 1 as otherwise we don't really care about context
+    def decode(self, ids) -> list:
+        """Maps token ids back to their tokens"""
+        return [self.id_to_token[token_id] for token_id in ids]
 
-        last_n_words = " ".join(sen.split(" ")[-curr_n+1:])
-        if curr_n > 1:
-            # TODO: add backoff here and linear interpolation in preprocess corpus
-            # filtering by n-grams that contain last n words as beginning
-            corpus_counts_filtered = {k: v for k,v in corpus_counts.items() if n_gram_contains_context_at_beginning(last_n_words, k)}
 
-            if len(corpus_counts_filtered) == 0:
-                print(f'No n-grams found for prefix "{last_n_words}"')
+class NGramCounter:
+    """
+    Accumulates counts of every order 1..n over a stream of token chunks, carrying the last n-1 tokens
+    across chunk boundaries so that the counts equal those of the concatenated corpus.
+    Memory is bounded by the size of the count tables rather than the size of the corpus.
+    """
 
-            # setting up a temporary n in case of backoff
-            temp_n=curr_n
+    def __init__(self, n: int, vocab: Optional[Vocabulary] = None):
+        """
+        args:
+            n: the largest n-gram size to count
+            vocab: vocabulary to intern tokens in, a new one by default
+        """
+        self.n = n
+        self.vocab = vocab if vocab is not None else Vocabulary()
+        self.total = 0
 
-            while len(corpus_counts_filtered) == 0 and backoff and temp_n > 1:
-                # backing off to a smaller n-gram
-                print(f"back off to n={temp_n-1}")
-                temp_n = temp_n - 1
-                corpus_counts = preprocess_corpus(corpus, temp_n, smoothing=smoothing, smoothing_k = 0.1)
-                last_n_words_temp = " ".join(sen.split(" ")[-temp_n+1:])
+        # sorted keys and counts for every order (see ngram_arrays), made with a vocabulary size of {self.base}
+        self.base = len(self.vocab)
+        self.keys = {order: np.zeros(0, dtype=np.int64) for order in range(1, n + 1)}
+        self.counts = {order: np.zeros(0, dtype=np.int64) for order in range(1, n + 1)}
 
-                # rebuilding corpus counts filtered with smaller n-gram size
-                corpus_counts_filtered = corpus_counts if temp_n==1 else {k: v for k,v in corpus_counts.items() if n_gram_contains_context_at_beginning(last_n_words_temp, k)}
+        # last n-1 ids of the stream, the beginning of n-grams completed by the next chunk
+        self.tail = np.zeros(0, dtype=np.int32)
 
-        # sampling from model, one gram if no availabilities
-        print('sampling from model...')
-        print(corpus_counts_filtered)
-        sen += " " + (sample(corpus_counts_filtered).split(" ")[-1] if len(corpus_counts_filtered) != 0 else sample(corpus_counts_one_gram))
+    def add_tables(self, keys: dict, counts: dict, base: int, word_ids: Optional[np.ndarray] = None) -> None:
+        """
+        Adds count tables of every order to the stored ones, an order at a time from 1 up: merging an order moves the rows
+        of its n-grams, so the keys of both tables one order up are re-encoded with their contexts' merged rows
+
+        args:
+            keys: dictionary from order to a sorted key array, each n-gram's context stored in the table one order down
+            counts: dictionary from order to the counts of those keys
+            base: the vocabulary size the keys were made with
+            word_ids: the id in this vocabulary of every id of the tables, if they were counted with another vocabulary
+        """
+        rows, other_rows = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+        for order in range(1, self.n + 1):
+            own_keys = reparent(self.keys[order], rows, self.base, len(self.vocab))
+            other_keys = reparent(keys[order], other_rows, base, len(self.vocab), word_ids)
+            self.keys[order], self.counts[order], rows, other_rows = merge_counts(own_keys, self.counts[order], other_keys, counts[order])
+
+        self.base = len(self.vocab)
 
-        # EOS decision
-        return_sentence = random.random() <= eos_prob
+    def prime(self, tokens: list) -> None:
+        """Sets the tokens preceding the stream without counting them, for counting a shard which continues an earlier one"""
+        self.tail = self.vocab.encode(tokens[max(0, len(tokens) - self.n + 1):], add=True)
 
-    print('returning result...')
-    return sen
+    @timed("count n-grams")
+    def update(self, tokens: list) -> None:
+        """
+        Counts the n-grams of the next chunk of tokens, including those spanning the previous chunk.
+        The n-grams lying within the carried tail are counted 0 times, they only provide the context rows
+        of the n-grams spanning the boundary (and after prime(), are left in the tables with a count of 0)
+        """
+        ids = self.vocab.encode(tokens, add=True)
+        self.total += len(ids)
 
+        stream = np.concatenate([self.tail, ids])
+        keys, counts = count_windows(stream, self.n, len(self.vocab), skip=len(self.tail))
+        self.add_tables(keys, counts, len(self.vocab))
 
+        self.tail = stream[max(0, len(stream) - self.n + 1):]
+
+    def merge(self, other: "NGramCounter") -> None:
+        """
+        Adds the counts of a counter over the following shard of the corpus, remapping its ids into this vocabulary.
+        Merging shards in corpus order assigns the same ids, and so gives the same counts, as counting serially.
+        """
+        # interning the other shard's tokens in its own first-appearance order
+        id_map = self.vocab.encode(other.vocab.id_to_token, add=True).astype(np.int64)
+        self.total += other.total
+        self.add_tables(other.keys, other.counts, other.base, id_map)
+        self.tail = id_map[other.tail].astype(np.int32)
 
-def get_sequence_probability(sequence: str, corpus_counts: dict, corpus_counts_one_less: dict,  n_gram_size: int) -> float:
+
+def last_tokens(text: str, count: int) -> list:
+    """Returns the last {count} tokens of a text (fewer if it has fewer), tokenizing only as much of its end as needed"""
+    window = 64
+    while True:
+        # the first token of a suffix may be a cut word, so one more token than needed is required
+        tokens = tokenize(text[max(0, len(text) - window):])
+        if len(tokens) > count or window >= len(text):
+            return tokens[max(0, len(tokens) - count):]
+        window *= 2
+
+
+def count_shard(text: str, n: int, overlap: list) -> NGramCounter:
     """
-    Returns the probability fo a given sequence in a given corpus, given a certain n-gram-size
-    
+    Tokenizes and counts one shard of a corpus, a worker task of count_n_grams_parallel
+
     args:
-        sequence: string of words
-        corpus_counts: dictionary of n-grams and their counts
-        corpus_counts_one_less: a dictionary of n-grams not including current word
-        n_gram_size: size of n-gram to use
+        text: text of the shard, cut at whitespace
+        n: the largest n-gram size to count
+        overlap: the last n-1 tokens of the previous shards, which only serve as context
 
     returns:
-        probability of sequence in corpus
+        the shard's counter
     """
-    # tokenizing sequence
-    tokenized = sequence.split(" ")
+    counter = NGramCounter(n)
+    counter.prime(overlap)
+    counter.update(tokenize(text))
+    return counter
 
-    # conditional probability multiplier
-    final_prob = 0
 
-    # probability updates
-    for counter in range(0, len(tokenized)-n_gram_size+1):
-        # obtaining n-gram
-        n_gram = " ".join(tokenized[counter:counter+n_gram_size])
-        n_gram_no_last_word=" ".join(tokenized[counter:counter+n_gram_size-1])
+@timed()
+def count_n_grams_parallel(chunks: Iterable[str], n: int, workers: int, shard_size: int = 1 << 22) -> NGramCounter:
+    """
+    Counts n-grams of every order 1..n on a pool of processes, splitting the corpus into shards which overlap by n-1 tokens.
+    Workers tokenize their own shard, and the result is identical to streaming the corpus through a single NGramCounter.
 
-        # returning final prob given space of context
-        # using log prob as to avoid underflow, and adding 0.0001 to avoid 0 probabilities
-        final_prob += math.log(corpus_counts.get(n_gram, 0.0001) / corpus_counts_one_less.get(n_gram_no_last_word, 1))
+    args:
+        chunks: iterable of consecutive text chunks of the corpus
+        n: the largest n-gram size to count
+        workers: number of worker processes
+        shard_size: approximate number of characters per shard
 
-    # returning final probability
-    return math.exp(final_prob)
-    
+    returns:
+        counter holding the merged counts
+    """
+    counter = NGramCounter(n)
+    pending = deque()
+    shard, overlap = "", []
 
-def get_next_word_prediction(sequence: str, corpus: str, n_gram_size:int = 2) -> float:
-    """Returns n-gram prediction for the next word given a certain text corpus"""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit(text: str) -> None:
+            nonlocal overlap
+            pending.append(executor.submit(count_shard, text, n, overlap))
 
-    # reprocessing to get counts dict for larger sequences (n-grams plus sequence)
-    corpus_n_grams = preprocess_corpus(corpus, n_gram_size)
-    words = preprocess_sequence(corpus).split(" ")
-    corpus_n_grams_one_less = preprocess_corpus(corpus, n_gram_size-1)
-    probs = []
-    
-    # checking every extension of sequence
-    for word in words:
+            # the last n-1 tokens so far, reaching into the previous overlap if the shard has fewer tokens than that
+            combined = overlap + last_tokens(text, n - 1)
+            overlap = combined[max(0, len(combined) - n + 1):]
 
-        # figuring out sequence with next word
-        current_seq = sequence + ' ' + word
+            # merging finished shards in corpus order, bounding the number of shards held in memory
+            while len(pending) > 2 * workers:
+                counter.merge(pending.popleft().result())
 
-        # getting probability of sequence with word and appending to list
-        current_seq_prob = get_sequence_probability(current_seq, corpus_n_grams, corpus_n_grams_one_less, n_gram_size)
-        probs.append((current_seq_prob, current_seq))
+        for chunk in chunks:
+            shard += chunk
+            if len(shard) >= shard_size:
+                # cutting the shard at its last whitespace, so no word is split between two shards
+                boundary = max(shard.rfind(" "), shard.rfind("\n"), shard.rfind("\t"))
+                if boundary >= 0:
+                    submit(shard[:boundary + 1])
+                    shard = shard[boundary + 1:]
 
-    # custom sorting for sequence probabilities
-    probs = sorted(probs, reverse=True, key=lambda x: x[0])
+        submit(shard)
+        while pending:
+            counter.merge(pending.popleft().result())
 
-    # returning most likely sequence
-    return probs[0][1]
+    return counter
 
 
-def preprocess_corpus(corpus: str, n_gram_size: int, smoothing: bool = False, smoothing_k: float = 1.0) -> dict:
+class CategoricalSampler:
+    """
+    Draws outcomes from a fixed count distribution using a precomputed cumulative count array,
+    so every draw is an O(log V) binary search with no loss of resolution for rare outcomes
     """
-    Segments corpus and turns it into an n-gram counts hashmap
-    
-    args:
-        corpus: string of words
-        n_gram_size: size of n-gram to use
-        smoothing: whether or not to apply laplacian smoothing
-        smoothing_k: the value to use as a smoothing k (default count) for non-existent n-grams if laplacian smoothing is used
 
-    returns:
-        dictionary of n-grams and their counts
+    def __init__(self, outcomes: np.ndarray, counts: np.ndarray):
+        """
+        args:
+            outcomes: array of outcomes (e.g. word ids)
+            counts: array of their (positive) counts
+        """
+        self.outcomes = outcomes
+        self.cum_counts = np.cumsum(counts, dtype=np.float64)
+
+    def draw(self, rng: np.random.Generator, size: Optional[int] = None):
+        """
+        Samples one outcome, or an array of {size} outcomes if size is given
+
+        args:
+            rng: numpy random generator to draw from (seed it for reproducible draws)
+            size: number of outcomes to draw in one batch
+
+        returns:
+            an outcome, or an array of outcomes if size is given
+        """
+        # a uniform draw over [0, total) lands in exactly one outcome's cumulative interval
+        return self.outcomes[np.searchsorted(self.cum_counts, rng.random(size) * self.cum_counts[-1], side="right")]
+
+
+class NGramModel:
     """
-    # preprocessing corpus
-    corpus_processed = preprocess_sequence(corpus).split(" ")
+    An n-gram language model which tokenizes its corpus once and stores counts for every order 1..n,
+    so that scoring, prediction and sampling only look counts up rather than recounting the corpus.
 
-    # counts dictionary
-    counts = {}
+    Tokens are interned in a Vocabulary and the n-grams of each order are held as a sorted int64 array of keys, each
+    combining the row of the n-gram's context one order down with its last id (see ngram_arrays), with a parallel
+    array of counts. Keys stay below (number of contexts) * |V|, so any vocabulary size and order fits in int64.
+    """
 
-    # iterating and hashing corpus words - ensuring that don't exceed corpus boundary (use only n-grams from corpus)
-    for i in range(len(corpus_processed) - n_gram_size+1):
-        # attaining current n-gram (combining words from list)
-        current_n_gram = " ".join(corpus_processed[i:i+n_gram_size])
+    def __init__(self, corpus: Union[str, Iterable[str]], n: int, smoothing: Optional[str] = None, smoothing_k: float = 1.0, seed: Optional[int] = None,
+                 workers: int = 1, sampler_cache_size: int = 4096):
+        """
+        args:
+            corpus: string of words to train on, or an iterable of consecutive text chunks (see read_corpus_chunks) to stream
+            n: the largest n-gram size the model holds counts for
+            smoothing: name of the smoothing method in smoothing.SMOOTHERS, None for maximum likelihood estimates
+            smoothing_k: the k added to every count if add-k smoothing is used
+            seed: seed of the generator used when sampling, for reproducible sentences
+            workers: number of processes to count the corpus on (see count_n_grams_parallel)
+            sampler_cache_size: number of most recently used per-context samplers kept (see get_sampler)
+        """
+        self.n = n
+        self.smoothing = smoothing
+        self.smoothing_k = smoothing_k
+
+        # random generator used for sampling and the most recently used samplers, cached per context
+        self.rng = np.random.default_rng(seed)
+        self.cached_sampler = lru_cache(maxsize=sampler_cache_size)(self.build_sampler)
+
+        # tokenizing corpus a single time, streaming it chunk by chunk into the counts of every order
+        chunks = [corpus] if isinstance(corpus, str) else corpus
+        if workers > 1:
+            counter = count_n_grams_parallel(chunks, n, workers)
+        else:
+            counter = NGramCounter(n)
+            for tokens in stream_tokens(chunks):
+                counter.update(tokens)
+
+        # sorted keys and counts for every order, order 0 holding the empty context (the total number of tokens)
+        self.vocab = counter.vocab
+        self.keys = {0: np.zeros(1, dtype=np.int64), **counter.keys}
+        self.counts = {0: np.array([counter.total], dtype=np.int64), **counter.counts}
+
+        # smoothed probabilities are computed on the fly from the stored counts
+        self.smoother = self.make_smoother()
+
+    def save(self, directory: str) -> None:
+        """
+        Saves the counted model to a directory: model.json (settings), vocab.txt (one token per line, in id order)
+        and keys_{order}.npy / counts_{order}.npy for every order, which load() memory-maps
 
-        # hashing - starting with default k
-        default_val = smoothing_k if smoothing else 0
-        counts[current_n_gram] = counts.get(current_n_gram, default_val) + 1
+        args:
+            directory: directory to write the model to, created if missing
+        """
+        os.makedirs(directory, exist_ok=True)
 
-    # for unseen n_grams
-    if smoothing:
-        print('smoothing counts... (this may take a while)')
-        pmts = get_k_random_permutations(corpus_processed, size=n_gram_size, k=1000)
-        
-        # iterating through permutations and assigning them smoothing value
-        for permutation in pmts:
+        with open(os.path.join(directory, "model.json"), "w") as metadata_writer:
+            json.dump({"n": self.n, "smoothing": self.smoothing, "smoothing_k": self.smoothing_k, "keys": "context rows"}, metadata_writer)
 
-            # if permutation yet to be seen, assigning it miniscule smoothing value
-            if permutation not in counts:
-                counts[permutation] = smoothing_k
-        
+        # tokens never contain whitespace, so newlines separate them unambiguously
+        with open(os.path.join(directory, "vocab.txt"), "w", encoding="utf-8") as vocab_writer:
+            vocab_writer.write("\n".join(self.vocab.id_to_token))
 
-    unwanted_chars = ['', ' ', '\n', '-']
+        for order in range(self.n + 1):
+            np.save(os.path.join(directory, f"keys_{order}.npy"), self.keys[order])
+            np.save(os.path.join(directory, f"counts_{order}.npy"), self.counts[order])
 
-    # removing unwanted characters
-    for char in unwanted_chars:
-        if char in counts.keys():
-            print(f'removing key {char}')
-            counts.pop(char)
+    @classmethod
+    def load(cls, directory: str, seed: Optional[int] = None, sampler_cache_size: int = 4096) -> "NGramModel":
+        """
+        Loads a model written by save(), memory-mapping its count arrays read-only so startup does not copy them
+        and processes loading the same model share its pages
 
-    # removing chars we don't want in the context of a key (if no next char then don't want newline/space as continuation)
-    unwanted_chars_in_keys=['\n']
-    counts_keys =  list(counts.keys())
+        args:
+            directory: directory the model was saved to
+            seed: seed of the generator used when sampling, for reproducible sentences
+            sampler_cache_size: number of most recently used per-context samplers kept (see get_sampler)
 
-    for key in counts_keys:
-        for char in unwanted_chars_in_keys:
-            if char in key:
-                counts.pop(key)
-                print('removing key {key}')
+        returns:
+            the loaded model
+        """
+        model = cls.__new__(cls)
 
-    return counts
+        with open(os.path.join(directory, "model.json"), "r") as metadata_reader:
+            metadata = json.load(metadata_reader)
+        model.n, model.smoothing, model.smoothing_k = metadata["n"], metadata["smoothing"], metadata["smoothing_k"]
+        if metadata.get("keys") != "context rows":
+            raise ValueError(f"{directory} holds n-gram keys packed in base |V|, train the model again and save it")
 
+        # random generator used for sampling and the most recently used samplers, cached per context
+        model.rng = np.random.default_rng(seed)
+        model.cached_sampler = lru_cache(maxsize=sampler_cache_size)(model.build_sampler)
 
-def get_k_random_permutations(corpus_lexicon: list, size: int = 2, k:int=100) -> list:
-    """Returns k random word combination permutations of size {size}"""
-    counter = 0 
-    final_permutations = []
+        with open(os.path.join(directory, "vocab.txt"), "r", encoding="utf-8") as vocab_reader:
+            model.vocab = Vocabulary(vocab_reader.read().split("\n"))
 
-    for i in range(k):
-        curr_word = []
+        model.keys = {order: np.load(os.path.join(directory, f"keys_{order}.npy"), mmap_mode="r") for order in range(model.n + 1)}
+        model.counts = {order: np.load(os.path.join(directory, f"counts_{order}.npy"), mmap_mode="r") for order in range(model.n + 1)}
+        model.smoother = model.make_smoother()
+        return model
 
-        # building a random word permutation
-        for word_idx in range(size):
-            curr_word.append(corpus_lexicon[random.randint(0, len(corpus_lexicon))-1])
+    def make_smoother(self) -> Optional[Smoother]:
+        """Builds the estimator named by self.smoothing, None for unsmoothed maximum likelihood estimates"""
+        if self.smoothing is None:
+            return None
 
-        # appending to list of word permutations
-        final_permutations.append(" ".join(curr_word))
+        assert self.smoothing in SMOOTHERS, f"smoothing must be one of {list(SMOOTHERS)}"
+        return AddKSmoother(self, k=self.smoothing_k) if self.smoothing == "add-k" else SMOOTHERS[self.smoothing](self)
 
-    return final_permutations
+    def get_counts(self, order: int, rows: np.ndarray) -> np.ndarray:
+        """Returns the stored counts of an array of rows of one order's table (see prefix_rows), 0 for unseen (-1) rows"""
+        count("n-gram lookups", len(rows))
+        return gather(self.counts[order], rows)
 
-        
+    @timed("filter continuations")
+    def find_context(self, context: list, backoff: bool = True) -> Optional[tuple]:
+        """
+        Finds the longest stored context for a list of preceding words
 
+        args:
+            context: list of preceding words, only the last n-1 are used
+            backoff: whether to shorten the context until continuations are found (ending at unigram counts)
 
+        returns:
+            (order, context row, start, end) where keys[order][start:end] are the context's continuations,
+            or None if the context was never seen and backoff is off
+        """
+        # n-gram either set to value of n or using maximal context otherwise available
+        order = min(self.n, len(context) + 1)
+        context_ids = self.vocab.encode(context[len(context) - order + 1:]) if order > 1 else np.empty(0, dtype=np.int32)
+        count("context lookups")
+
+        while True:
+            # continuations of a context are the contiguous keys in [context row * V, (context row + 1) * V)
+            used_ids = context_ids[len(context_ids) - order + 1:] if order > 1 else context_ids[:0]
+            context_row = int(prefix_rows(self.keys, used_ids[np.newaxis].astype(np.int64), len(self.vocab))[0, -1])
+            if context_row >= 0:
+                start, end = np.searchsorted(self.keys[order], [context_row * len(self.vocab), (context_row + 1) * len(self.vocab)])
+                if end > start or order == 1:
+                    return order, context_row, start, end
+
+            if not backoff or order == 1:
+                return None
+            order -= 1
+            count("backoffs")
+
+    def get_continuations(self, context: list, backoff: bool = True) -> Counter:
+        """
+        Returns the counts of every word observed after a context, found in time proportional to the number of continuations
+
+        args:
+            context: list of preceding words, only the last n-1 are used
+            backoff: whether to shorten the context until continuations are found (ending at unigram counts)
+
+        returns:
+            Counter from continuation word to count, empty if the context was never seen and backoff is off
+        """
+        found = self.find_context(context, backoff)
+        if found is None:
+            return Counter()
+
+        order, _, start, end = found
+        words = self.vocab.decode(self.keys[order][start:end] % len(self.vocab))
+        return Counter(dict(zip(words, self.counts[order][start:end].tolist())))
+
+    def get_word_probabilities(self, context: list, n_gram_size: Optional[int] = None) -> np.ndarray:
+        """Smoothed probabilities of every vocabulary word (indexed by id) following the last n-1 words of a context"""
+        n_gram_size = self.n if n_gram_size is None else n_gram_size
+        context_ids = self.vocab.encode(context[max(0, len(context) - n_gram_size + 1):])
+
+        # one n-gram per vocabulary word, all sharing the context
+        columns = np.empty((len(self.vocab), len(context_ids) + 1), dtype=np.int64)
+        columns[:, :-1] = context_ids
+        columns[:, -1] = np.arange(len(self.vocab))
+        return self.smoother.probabilities(columns)
+
+    def get_sampler(self, context: list, backoff: bool = True) -> Optional[CategoricalSampler]:
+        """
+        Returns the sampler over the word ids continuing a context, from an LRU cache of the most recently used contexts,
+        as smoothed samplers hold an array over the whole vocabulary
+        """
+        return self.cached_sampler(tuple(context[max(0, len(context) - self.n + 1):]), backoff)
+
+    def build_sampler(self, context: tuple, backoff: bool = True) -> Optional[CategoricalSampler]:
+        """Builds the sampler of get_sampler, None if the context was never seen and backoff is off"""
+        count("samplers built")
+
+        # with smoothing every word can follow any context, so samplers cover the whole vocabulary
+        if self.smoother is not None:
+            return CategoricalSampler(np.arange(len(self.vocab)), self.get_word_probabilities(list(context)))
+
+        found = self.find_context(list(context), backoff)
+        if found is None:
+            return None
+
+        order, _, start, end = found
+        return CategoricalSampler(self.keys[order][start:end] % len(self.vocab), self.counts[order][start:end])
+
+    def get_sequence_log_probability(self, sequence: str, n_gram_size: Optional[int] = None) -> float:
+        """
+        Returns the natural log probability of a given sequence under the model, given a certain n-gram-size.
+        Tokenized like the corpus and scored by score_sequences, so both give the same result for the same text
+
+        args:
+            sequence: string of words
+            n_gram_size: size of n-gram to use, defaults to the model's n
+
+        returns:
+            log probability of sequence in corpus, 0.0 if the sequence is shorter than the n-gram size
+        """
+        n_gram_size = self.n if n_gram_size is None else n_gram_size
+        assert 1 <= n_gram_size <= self.n, f"n-gram size must be between 1 and {self.n}"
+        return float(self.score_sequences([sequence], orders=[n_gram_size])[n_gram_size]["log_probs"][0])
+
+    def get_sequence_probability(self, sequence: str, n_gram_size: Optional[int] = None) -> float:
+        """
+        Returns the probability of a given sequence under the model, given a certain n-gram-size.
+        Underflows to 0.0 for long sequences, use get_sequence_log_probability to compare those
+
+        args:
+            sequence: string of words
+            n_gram_size: size of n-gram to use, defaults to the model's n
+
+        returns:
+            probability of sequence in corpus
+        """
+        return math.exp(self.get_sequence_log_probability(sequence, n_gram_size))
+
+    def get_window_log_probabilities(self, columns: np.ndarray) -> np.ndarray:
+        """
+        Returns the log probability of the last word of every n-gram given the words before it
+
+        args:
+            columns: (number of n-grams, order) id matrix, -1 marking words missing from the vocabulary
+
+        returns:
+            float array of one log probability per n-gram
+        """
+        columns = columns.astype(np.int64)
+        if self.smoother is not None:
+            return self.smoother.log_probabilities(columns)
+
+        # vectorized lookups of every n-gram and, on the way, of its context (the empty context of a unigram is the total)
+        order = columns.shape[1]
+        rows = prefix_rows(self.keys, columns, len(self.vocab))
+        n_gram_counts = self.get_counts(order, rows[:, -1])
+        context_counts = self.get_counts(order - 1, rows[:, -2])
+
+        # adding 0.0001 to avoid 0 probabilities
+        return np.log(np.where(n_gram_counts > 0, n_gram_counts, 0.0001) / np.where(context_counts > 0, context_counts, 1))
+
+    @timed()
+    def score_sequences(self, sequences: Iterable[str], orders: Optional[list] = None, batch_size: int = 10_000) -> dict:
+        """
+        Scores many sequences under several n-gram sizes in one pass, looking up a whole batch of sequences at a time
 
+        args:
+            sequences: iterable of sequences (e.g. read_sentences of a held-out file), preprocessed like the corpus
+            orders: n-gram sizes to score with, defaults to every order 1..n
+            batch_size: number of sequences whose n-grams are looked up together
+
+        returns:
+            dictionary from order to {"log_probs": log probability of every sequence,
+                                      "num_predictions": number of scored n-grams of every sequence,
+                                      "perplexity": perplexity of all the sequences together}
+        """
+        orders = list(range(1, self.n + 1)) if orders is None else orders
+        assert all(1 <= order <= self.n for order in orders), f"n-gram sizes must be between 1 and {self.n}"
+
+        log_probs = {order: [] for order in orders}
+        num_predictions = {order: [] for order in orders}
+
+        for batch in batched(sequences, batch_size):
+            # concatenating the batch's ids, remembering the sequence each position belongs to
+            tokenized = [self.vocab.encode(tokenize(sequence)) for sequence in batch]
+            lengths = np.array([len(ids) for ids in tokenized])
+            ids = np.concatenate(tokenized) if tokenized else np.zeros(0, dtype=np.int32)
+            sequence_of = np.repeat(np.arange(len(batch)), lengths)
+
+            for order in orders:
+                if len(ids) < order:
+                    log_probs[order].append(np.zeros(len(batch)))
+                    num_predictions[order].append(np.zeros(len(batch), dtype=np.int64))
+                    continue
+
+                # only windows lying within a single sequence are scored
+                within = sequence_of[:len(ids) - order + 1] == sequence_of[order - 1:]
+                windows = np.lib.stride_tricks.sliding_window_view(ids, order)[within]
+
+                # summing the window log probabilities of every sequence
+                log_probs[order].append(np.bincount(sequence_of[:len(ids) - order + 1][within], weights=self.get_window_log_probabilities(windows), minlength=len(batch)))
+                num_predictions[order].append(np.maximum(lengths - order + 1, 0))
+
+        results = {}
+        for order in orders:
+            order_log_probs = np.concatenate(log_probs[order]) if log_probs[order] else np.zeros(0)
+            order_predictions = np.concatenate(num_predictions[order]) if num_predictions[order] else np.zeros(0, dtype=np.int64)
+            results[order] = {
+                "log_probs": order_log_probs,
+                "num_predictions": order_predictions,
+                "perplexity": math.exp(-order_log_probs.sum() / max(order_predictions.sum(), 1)),
+            }
+        return results
+
+    def get_next_word_prediction(self, sequence: str, n_gram_size: Optional[int] = None) -> str:
+        """Returns the sequence, tokenized like the corpus, extended by the model's most likely next word"""
+        return " ".join(tokenize(sequence) + [self.get_top_k_next_words(sequence, k=1, n_gram_size=n_gram_size)[0][0]])
+
+    def get_top_k_next_words(self, sequence: str, k: int = 5, n_gram_size: Optional[int] = None) -> list:
+        """
+        Returns the k most likely next words for a sequence, backing off to shorter contexts if the context was never seen
+
+        args:
+            sequence: string of words to extend, tokenized like the corpus
+            k: number of candidates to return
+            n_gram_size: size of n-gram to use, defaults to the model's n
+
+        returns:
+            list of (word, conditional probability) tuples, most likely first
+        """
+        n_gram_size = self.n if n_gram_size is None else n_gram_size
+        assert 1 <= n_gram_size <= self.n, f"n-gram size must be between 1 and {self.n}"
+
+        # every candidate shares the sequence prefix, so ranking them only needs the last n-1 words
+        words = tokenize(sequence)
+        context = words[max(0, len(words) - n_gram_size + 1):] if n_gram_size > 1 else []
+
+        # smoothed estimates rank the whole vocabulary
+        if self.smoother is not None:
+            probabilities = self.get_word_probabilities(context, n_gram_size)
+            top = np.argsort(-probabilities, kind="stable")[:k]
+            return list(zip(self.vocab.decode(top), probabilities[top].tolist()))
+
+        order, _, start, end = self.find_context(context)
+        counts = self.counts[order][start:end]
+
+        # ranking only the continuations of the context
+        top = np.argsort(-counts, kind="stable")[:k]
+        words = self.vocab.decode(self.keys[order][start:end][top] % len(self.vocab))
+        return list(zip(words, (counts[top] / counts.sum()).tolist()))
+
+    def model_sample(self, eos_prob: float = 0.05, backoff: bool = False) -> str:
+        """
+        Samples a random sentence from the n-gram language model.
+
+        :param eos_prob: the probability that the next token will be an end of sentence token (the sentence will end and the result will be returned)
+        :param backoff: whether to back off to smaller n-grams when the current context has no continuations
+
+        :returns: a string, the sampled sentence
+        """
+        return self.sample_sentences(1, eos_prob=eos_prob, backoff=backoff)[0]
+
+    @timed()
+    def sample_sentences(self, num_sentences: int, eos_prob: float = 0.05, backoff: bool = False) -> list:
+        """
+        Samples many random sentences from the n-gram language model, reusing the cached per-context samplers.
+
+        :param num_sentences: the number of sentences to sample
+        :param eos_prob: the probability that the next token will be an end of sentence token
+        :param backoff: whether to back off to smaller n-grams when the current context has no continuations
+
+        :returns: a list of strings, the sampled sentences
+        """
+        # if smoothing used, backoff will never be used
+        assert not (self.smoothing and backoff), "use of smoothing automatically implies backoff will never be used"
+
+        # obtaining every first word in a single batched draw
+        unigram_sampler = self.get_sampler([])
+        sentences = []
+
+        for first_word in self.vocab.decode(unigram_sampler.draw(self.rng, size=num_sentences)):
+            sen = [first_word]
+
+            # boolean denoting whether constructed sentence should end and be returned
+            return_sentence = False
+
+            # appending words repeatedly to first word
+            while not return_sentence:
+                # sampler over the continuations of the last n-1 words, one gram if no availabilities
+                sampler = self.get_sampler(sen, backoff=backoff)
+                if sampler is None:
+                    count("sampling dead ends")
+                    logger.debug('No n-grams found for prefix "%s"', " ".join(sen[-self.n+1:]))
+                    sampler = unigram_sampler
+
+                sen.append(self.vocab.id_to_token[sampler.draw(self.rng)])
+
+                # EOS decision
+                return_sentence = self.rng.random() <= eos_prob
+
+            sentences.append(" ".join(sen))
+
+        return sentences
 
 
 if __name__ == "__main__":
@@ -285,42 +730,48 @@ if __name__ == "__main__":
     parser.add_argument('--sequence', type = str, default='check this', required=False)
     parser.add_argument('--n-gram', type = int, default=2, required=False)
     parser.add_argument('--sample', type = bool, default=True, required=False)
-    parser.add_argument('--smoothing', type=bool, default=False, required=False)
+    parser.add_argument('--smoothing', type=str, default=None, required=False, choices=list(SMOOTHERS))
+    parser.add_argument('--smoothing-k', type=float, default=0.1, required=False)
     parser.add_argument('--backoff', type=bool, default=False, required=False)
+    parser.add_argument('--seed', type=int, default=None, required=False)
+    parser.add_argument('--workers', type=int, default=1, required=False)
+    parser.add_argument('--save-model', type=str, default=None, required=False, help='directory to save the trained model to')
+    parser.add_argument('--load-model', type=str, default=None, required=False, help='directory of a saved model to load instead of training')
+    add_instrumentation_arguments(parser)
 
 
     # parsing argument
     args = parser.parse_args()
 
-    # 1. preprocess the sequence and corpus
-    proc_seq = preprocess_sequence(args.sequence)
-
-    # processing corpus and turning into a counts dictionary
-    with open(args.corpus, 'r') as corpus_reader:
-        corpus = corpus_reader.read()
-
-    corpus_counts = preprocess_corpus(corpus, args.n_gram)
-    corpus_counts_one_less = preprocess_corpus(corpus, args.n_gram-1)
-    corpus_counts_one_gram = preprocess_corpus(corpus, 1)
+    # running the pipeline under the instrumentation flags
+    with instrumented(args):
+        # 1. preprocess the sequence and corpus
+        proc_seq = preprocess_sequence(args.sequence)
 
+        # loading a saved model, or training it a single time by streaming the corpus file, holding counts for every order up to n
+        if args.load_model:
+            model = NGramModel.load(args.load_model, seed=args.seed)
+        else:
+            model = NGramModel(read_corpus_chunks(args.corpus), args.n_gram, smoothing=args.smoothing, smoothing_k=args.smoothing_k, seed=args.seed, workers=args.workers)
 
-    # 2. use corpus to return the probability of the sequence
-    print(get_sequence_probability(proc_seq, corpus_counts,corpus_counts_one_less, args.n_gram))
+        if args.save_model:
+            model.save(args.save_model)
 
-    # 3. predict next word in the sequence
-    print(f"Next word prediction: {get_next_word_prediction(proc_seq, corpus, args.n_gram)}")
+        # 2. use corpus to return the probability of the sequence
+        print(model.get_sequence_probability(proc_seq))
+        print(f"Log probability: {model.get_sequence_log_probability(proc_seq)}")
 
-    # 4. sample a random sentence from the model
+        # 3. predict next word in the sequence
+        print(f"Next word prediction: {model.get_next_word_prediction(proc_seq)}")
 
-    if args.sample:
-        # explaining sampling methodology
-        if args.smoothing:
-            print('sampling from model with smoothing')
+        # 4. sample a random sentence from the model
 
-        if args.backoff:
-            print('sampling from model with backoff')
+        if args.sample:
+            # explaining sampling methodology
+            if args.smoothing:
+                logger.info('sampling from model with %s smoothing', args.smoothing)
 
-        print(f"Sampled sentence: {model_sample(corpus, args.n_gram, smoothing=args.smoothing, backoff=args.backoff)}")
+            if args.backoff:
+                logger.info('sampling from model with backoff')
 
-    
-    
+            print(f"Sampled sentence: {model.model_sample(backoff=args.backoff)}")
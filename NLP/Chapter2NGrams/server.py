@@ -0,0 +1,234 @@
+# A long-running local server answering n-gram model queries over TCP or a unix socket, loading the model once.
+# The protocol is one json object per line each way: requests carry an "op" and its arguments, plus an optional "id"
+# echoed back in the response, which holds either a "result" or an "error":
+#   {"op": "probability", "sequence": "..."}                                 -> {"probability": p, "log_prob": lp}
+#   {"op": "predict", "sequence": "...", "k": 5}                             -> [[word, probability], ...]
+#   {"op": "sample", "prefix": "...", "top_k": null, "top_p": null, "max_length": 50} -> "sampled sentence"
+# Concurrent requests of a kind are grouped into micro-batches, so scoring many sequences is one vectorized lookup
+import argparse
+import asyncio
+import json
+import logging
+import math
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from ngrams import NGramModel, preprocess_sequence, read_corpus_chunks
+from smoothing import SMOOTHERS
+from decoding import Decoder
+from utils.instrumentation import add_instrumentation_arguments, count, instrumented, timed  # on the path ngrams sets up
+
+logger = logging.getLogger(__name__)
+
+
+def is_positive_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def validate_request(request) -> None:
+    """Checks the fields of a request before it joins a batch, so a malformed request only fails itself (ValueError)"""
+    if not isinstance(request, dict):
+        raise ValueError("a request must be a json object")
+
+    if request.get("op") in ("probability", "predict") and not isinstance(request.get("sequence"), str):
+        raise ValueError("sequence must be a string")
+    if request.get("op") == "predict" and not is_positive_int(request.get("k", 5)):
+        raise ValueError("k must be a positive integer")
+
+    if request.get("op") == "sample":
+        if not isinstance(request.get("prefix", ""), str):
+            raise ValueError("prefix must be a string")
+        if request.get("top_k") is not None and not is_positive_int(request["top_k"]):
+            raise ValueError("top_k must be a positive integer or null")
+        top_p = request.get("top_p")
+        if top_p is not None and (isinstance(top_p, bool) or not isinstance(top_p, (int, float)) or not 0 < top_p <= 1):
+            raise ValueError("top_p must be a number in (0, 1] or null")
+        if not is_positive_int(request.get("max_length", 50)):
+            raise ValueError("max_length must be a positive integer")
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into batches: the first pending request starts a batch, which closes once it holds
+    max_batch_size requests or max_delay seconds have passed, and is then processed by a single call
+    """
+
+    def __init__(self, process_batch: Callable, executor: ThreadPoolExecutor, max_batch_size: int = 256, max_delay: float = 0.002):
+        """
+        args:
+            process_batch: function of a list of requests returning the list of their results
+            executor: executor the batches run on, a single thread serializing every access to the model
+            max_batch_size: largest number of requests per batch
+            max_delay: seconds a batch waits for more requests after its first
+        """
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    async def submit(self, request: dict):
+        """Queues a request and waits for its result"""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+
+            # filling the batch until it is full or its delay runs out
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(deadline - loop.time(), 0)))
+                except asyncio.TimeoutError:
+                    break
+
+            count("batches")
+            count("batched requests", len(batch))
+            requests, futures = zip(*batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, list(requests))
+            except Exception:
+                # retrying the requests one by one, so an error only fails the request that caused it
+                await self.run_individually(requests, futures)
+                continue
+
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def run_individually(self, requests: tuple, futures: tuple) -> None:
+        """Processes every request of a failed batch alone, setting each error on its own request's future"""
+        loop = asyncio.get_running_loop()
+        for request, future in zip(requests, futures):
+            try:
+                result = (await loop.run_in_executor(self.executor, self.process_batch, [request]))[0]
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            if not future.done():
+                future.set_result(result)
+
+
+class ModelServer:
+    """Answers the protocol's requests from a loaded model, batching each kind of request separately"""
+
+    def __init__(self, model: NGramModel, max_batch_size: int = 256, max_delay: float = 0.002):
+        self.model = model
+        self.decoder = Decoder(model)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batchers = {
+            "probability": MicroBatcher(self.score_batch, self.executor, max_batch_size, max_delay),
+            "predict": MicroBatcher(self.predict_batch, self.executor, max_batch_size, max_delay),
+            "sample": MicroBatcher(self.sample_batch, self.executor, max_batch_size, max_delay),
+        }
+
+    @timed()
+    def score_batch(self, requests: list) -> list:
+        """Scores every sequence of a batch with one call to score_sequences"""
+        log_probs = self.model.score_sequences([preprocess_sequence(request["sequence"]) for request in requests], orders=[self.model.n])[self.model.n]["log_probs"]
+        return [{"probability": math.exp(log_prob), "log_prob": log_prob} for log_prob in log_probs.tolist()]
+
+    @timed()
+    def predict_batch(self, requests: list) -> list:
+        """Ranks the next words of every sequence of a batch, each context found by a binary search over the sorted counts"""
+        return [self.model.get_top_k_next_words(request["sequence"], k=request.get("k", 5)) for request in requests]
+
+    @timed()
+    def sample_batch(self, requests: list) -> list:
+        """Samples every prefix of a batch, advancing all requests with the same decoding settings together"""
+        groups = defaultdict(list)
+        for index, request in enumerate(requests):
+            groups[request.get("top_k"), request.get("top_p"), request.get("max_length", 50)].append(index)
+
+        results = [None] * len(requests)
+        for (top_k, top_p, max_length), indices in groups.items():
+            sentences = self.decoder.sample([requests[index].get("prefix", "") for index in indices], top_k, top_p, max_length=max_length)
+            for index, sentence in zip(indices, sentences):
+                results[index] = sentence
+        return results
+
+    async def handle_request(self, line: bytes) -> dict:
+        """Answers one request line"""
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id") if isinstance(request, dict) else None
+            validate_request(request)
+            if request.get("op") not in self.batchers:
+                raise ValueError(f"op must be one of {list(self.batchers)}")
+            return {"id": request_id, "result": await self.batchers[request["op"]].submit(request)}
+        except Exception as error:
+            count("failed requests")
+            return {"id": request_id, "error": f"{type(error).__name__}: {error}"}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers the requests of a connection concurrently, writing each response as soon as it is ready"""
+        pending = set()
+
+        async def respond(line: bytes) -> None:
+            writer.write((json.dumps(await self.handle_request(line)) + "\n").encode())
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    task = asyncio.get_running_loop().create_task(respond(line))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            logger.debug("client disconnected")
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_socket: Optional[str] = None) -> None:
+        """Serves until cancelled, on a unix socket if one is given and on TCP otherwise"""
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+
+        logger.warning("serving a %d-gram model on %s", self.model.n, unix_socket if unix_socket is not None else f"{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # obtaining arguments with argparse
+    parser = argparse.ArgumentParser("N-gram server", description="Serves probabilities, predictions and samples of an n-gram model")
+    parser.add_argument('--corpus', type=str, default='corpus.txt', required=False)
+    parser.add_argument('--load-model', type=str, default=None, required=False, help='directory of a saved model to load instead of training')
+    parser.add_argument('--n-gram', type=int, default=3, required=False)
+    parser.add_argument('--smoothing', type=str, default=None, required=False, choices=list(SMOOTHERS))
+    parser.add_argument('--seed', type=int, default=None, required=False)
+    parser.add_argument('--host', type=str, default='127.0.0.1', required=False)
+    parser.add_argument('--port', type=int, default=8765, required=False)
+    parser.add_argument('--unix-socket', type=str, default=None, required=False, help='path of a unix socket to serve on instead of TCP')
+    parser.add_argument('--max-batch-size', type=int, default=256, required=False)
+    parser.add_argument('--max-delay-ms', type=float, default=2.0, required=False, help='milliseconds a batch waits for more requests')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented(args):
+        if args.load_model:
+            model = NGramModel.load(args.load_model, seed=args.seed)
+        else:
+            model = NGramModel(read_corpus_chunks(args.corpus), args.n_gram, smoothing=args.smoothing, seed=args.seed)
+
+        try:
+            asyncio.run(ModelServer(model, args.max_batch_size, args.max_delay_ms / 1000).serve(args.host, args.port, args.unix_socket))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,206 @@
+# Smoothing and backoff estimators computed on the fly from the count tables of an NGramModel
+import numpy as np
+from typing import Optional
+from ngram_arrays import prefix_rows, gather, suffix_rows
+
+
+def group_by_context(keys: np.ndarray, values: np.ndarray, base: int, num_contexts: int) -> tuple:
+    """
+    Groups a table of n-gram keys by their context (every id but the last), which is a row of the table one order down
+
+    args:
+        keys: array of n-gram keys (see ngram_arrays)
+        values: array of the values of those keys
+        base: the vocabulary size the keys are made with
+        num_contexts: number of rows of the table one order down
+
+    returns:
+        (sum of values per context row, number of continuations with a positive value per context row)
+    """
+    contexts = keys // base
+    totals = np.bincount(contexts, weights=values, minlength=num_contexts).astype(values.dtype)
+    return totals, np.bincount(contexts[values > 0], minlength=num_contexts)
+
+
+class Smoother:
+    """
+    Base class of estimators of P(word | context), which look up stored counts and per-context totals
+    precomputed once, so no memory is spent on unseen n-grams.
+
+    Probabilities are computed for a batch of n-grams at a time, given as an (number of n-grams, order) id matrix
+    in which -1 marks a word missing from the vocabulary. Such words share one extra vocabulary slot.
+    Per-context statistics are arrays indexed by the row of the context in the table one order down.
+    """
+
+    def __init__(self, model):
+        """
+        args:
+            model: the NGramModel whose counts to smooth
+        """
+        self.model = model
+        self.base = len(model.vocab)
+
+        # number of word types including the unknown word slot
+        self.num_types = self.base + 1
+
+        # for every order, the total count and number of continuation types of every context
+        self.context_totals, self.context_types = {}, {}
+        for order in range(1, model.n + 1):
+            self.context_totals[order], self.context_types[order] = group_by_context(model.keys[order], model.counts[order], self.base, len(model.keys[order - 1]))
+
+    def find(self, columns: np.ndarray) -> np.ndarray:
+        """Rows of every prefix of the n-grams of an id matrix (see prefix_rows), n-grams with unknown words having none"""
+        return prefix_rows(self.model.keys, columns, self.base)
+
+    def lookup(self, columns: np.ndarray) -> tuple:
+        """
+        Stored counts of the n-grams of an id matrix, and total count and number of continuation types of their contexts
+        (every column but the last), all found in one walk down the tables
+        """
+        order = columns.shape[1]
+        rows = self.find(columns)
+        return (gather(self.model.counts[order], rows[:, -1]),
+                gather(self.context_totals[order], rows[:, -2]),
+                gather(self.context_types[order], rows[:, -2]))
+
+    def probabilities(self, columns: np.ndarray) -> np.ndarray:
+        """
+        Returns the smoothed probability of the last word of every n-gram given the words before it
+
+        args:
+            columns: (number of n-grams, order) id matrix, order at most the model's n
+
+        returns:
+            float array of one probability per n-gram
+        """
+        raise NotImplementedError
+
+    def log_probabilities(self, columns: np.ndarray) -> np.ndarray:
+        """Natural log of probabilities(), the form to sum when scoring sequences"""
+        return np.log(self.probabilities(columns))
+
+
+class AddKSmoother(Smoother):
+    """Additive (laplacian for k=1) smoothing: P(w | h) = (c(hw) + k) / (c(h) + k|V|)"""
+
+    def __init__(self, model, k: float = 1.0):
+        super().__init__(model)
+        self.k = k
+
+    def probabilities(self, columns: np.ndarray) -> np.ndarray:
+        counts, totals, _ = self.lookup(columns)
+        return (counts + self.k) / (totals + self.k * self.num_types)
+
+
+class InterpolatedSmoother(Smoother):
+    """
+    Jelinek-Mercer interpolation of the maximum likelihood estimates of every order with the uniform distribution,
+    P(w | h) = lambda_0 / |V| + sum over orders j of lambda_j * P_ML(w | last j-1 words of h).
+    Computed recursively from the lowest order up, so an unseen context hands its weight to the orders below it.
+    """
+
+    def __init__(self, model, lambdas: Optional[list] = None):
+        """
+        args:
+            model: the NGramModel whose counts to smooth
+            lambdas: weights of the uniform distribution (index 0) and of every order 1..n.
+                     Defaults to 0.01 for the uniform distribution and an even split of the rest
+        """
+        super().__init__(model)
+        self.lambdas = np.asarray(lambdas if lambdas is not None else [0.01] + [0.99 / model.n] * model.n, dtype=np.float64)
+        assert len(self.lambdas) == model.n + 1, f"expected {model.n + 1} interpolation weights"
+
+    def probabilities(self, columns: np.ndarray) -> np.ndarray:
+        order = columns.shape[1]
+        probabilities = np.full(len(columns), 1 / self.num_types)
+
+        # mixing in the maximum likelihood estimate of every order, using the last j words of each n-gram
+        for j in range(1, order + 1):
+            suffix = columns[:, order - j:]
+            counts, totals, _ = self.lookup(suffix)
+            weight = self.lambdas[j] / self.lambdas[:j + 1].sum()
+
+            mixed = weight * counts / np.maximum(totals, 1) + (1 - weight) * probabilities
+            probabilities = np.where(totals > 0, mixed, probabilities)
+
+        return probabilities
+
+
+class StupidBackoffSmoother(Smoother):
+    """
+    Stupid backoff (Brants et al. 2007): relative frequency of the longest seen n-gram, times alpha for every order backed off.
+    Scores are not normalized, unknown words score as if seen once.
+    """
+
+    def __init__(self, model, alpha: float = 0.4):
+        super().__init__(model)
+        self.alpha = alpha
+
+    def probabilities(self, columns: np.ndarray) -> np.ndarray:
+        order = columns.shape[1]
+        scores = np.zeros(len(columns))
+        found = np.zeros(len(columns), dtype=bool)
+
+        # from the longest n-gram down, scoring each n-gram at the first order it was seen
+        for j in range(order, 0, -1):
+            suffix = columns[:, order - j:]
+            counts, totals, _ = self.lookup(suffix)
+
+            seen = ~found & (counts > 0)
+            scores[seen] = self.alpha ** (order - j) * counts[seen] / totals[seen]
+            found |= seen
+
+        scores[~found] = self.alpha ** (order - 1) / self.model.counts[0][0]
+        return scores
+
+
+class KneserNeySmoother(Smoother):
+    """
+    Interpolated Kneser-Ney smoothing with an absolute discount D. The highest order discounts raw counts,
+    lower orders discount continuation counts N1+(. w), the number of distinct words each n-gram follows,
+    and the unigram level interpolates with the uniform distribution.
+    """
+
+    def __init__(self, model, discount: float = 0.75):
+        super().__init__(model)
+        self.discount = discount
+
+        # continuation counts of every lower order, from the distinct left extensions in the table one order up:
+        # as its n-grams are distinct, the number of them whose suffix is an n-gram is that n-gram's continuation count
+        self.continuation_counts, self.continuation_context_totals, self.continuation_context_types = {}, {}, {}
+        for order in range(1, model.n):
+            self.continuation_counts[order] = np.bincount(suffix_rows(model.keys, order + 1, self.base), minlength=len(model.keys[order]))
+            (self.continuation_context_totals[order],
+             self.continuation_context_types[order]) = group_by_context(model.keys[order], self.continuation_counts[order], self.base, len(model.keys[order - 1]))
+
+    def probabilities(self, columns: np.ndarray) -> np.ndarray:
+        order = columns.shape[1]
+        probabilities = np.full(len(columns), 1 / self.num_types)
+
+        # recursively interpolating from the unigram level up, every level discounting its counts
+        for j in range(1, order + 1):
+            suffix = columns[:, order - j:]
+            if j == order:
+                counts, totals, types = self.lookup(suffix)
+            else:
+                rows = self.find(suffix)
+                counts = gather(self.continuation_counts[j], rows[:, -1])
+                totals = gather(self.continuation_context_totals[j], rows[:, -2])
+                types = gather(self.continuation_context_types[j], rows[:, -2])
+
+            # unseen contexts pass the lower order estimate through unchanged
+            seen = totals > 0
+            safe_totals = np.maximum(totals, 1)
+            discounted = np.maximum(counts - self.discount, 0) / safe_totals + self.discount * types / safe_totals * probabilities
+            probabilities = np.where(seen, discounted, probabilities)
+
+        return probabilities
+
+
+# smoothing methods by name, as accepted by NGramModel(smoothing=...)
+SMOOTHERS = {
+    "add-k": AddKSmoother,
+    "interpolated": InterpolatedSmoother,
+    "stupid-backoff": StupidBackoffSmoother,
+    "kneser-ney": KneserNeySmoother,
+}
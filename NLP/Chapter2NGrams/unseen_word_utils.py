@@ -1,27 +1,108 @@
 # A file for experiments with dealing with previously unseen words
-from ngrams import preprocess_sequence, preprocess_corpus
+from ngrams import NGramCounter, read_corpus_chunks, stream_tokens, tokenize
+from typing import Iterable, Union
 import argparse
+import numpy as np
+
+
+class TrainingVocabulary:
+    """
+    Word counts of a training corpus, counted in a single streaming pass, from which every unknown word statistic is answered.
+    Counts are kept as an array indexed by word id along with a sorted copy, so threshold and percentile
+    queries are binary searches rather than rescans of the corpus.
+    """
+
+    def __init__(self, training_corpus: Union[str, Iterable[str]]):
+        """
+        args:
+            training_corpus: string of words, or an iterable of consecutive text chunks (see read_corpus_chunks)
+        """
+        counter = NGramCounter(1)
+        for tokens in stream_tokens([training_corpus] if isinstance(training_corpus, str) else training_corpus):
+            counter.update(tokens)
+
+        # unigram keys are the word ids themselves
+        self.vocab = counter.vocab
+        self.counts = np.zeros(len(self.vocab), dtype=np.int64)
+        self.counts[counter.keys[1]] = counter.counts[1]
+
+        # ascending counts, and the number of training tokens covered by the smallest counts
+        self.sorted_counts = np.sort(self.counts)
+        self.cumulative_tokens = np.cumsum(self.sorted_counts)
+
+    def unk_rate_from_corpus(self, val_corpus: Union[str, Iterable[str]]) -> float:
+        """Proportion of the words (tokens) of a validation corpus which never appear in training, checked against the hashed vocabulary"""
+        num_tokens, num_unknown = 0, 0
+        for tokens in stream_tokens([val_corpus] if isinstance(val_corpus, str) else val_corpus):
+            num_tokens += len(tokens)
+            num_unknown += sum(token not in self.vocab for token in tokens)
+
+        return num_unknown / max(num_tokens, 1)
+
+    def unk_rate_by_threshold(self, threshold: int) -> float:
+        """Proportion of word types whose count is below a threshold"""
+        return np.searchsorted(self.sorted_counts, threshold, side="left") / len(self.sorted_counts)
+
+    def threshold_by_ranking(self, bottom_pct_unk: float) -> int:
+        """Count threshold below which the bottom {bottom_pct_unk} percent of word types fall"""
+        return int(self.sorted_counts[min(int(len(self.sorted_counts) * bottom_pct_unk / 100), len(self.sorted_counts) - 1)])
+
+    def unk_rate_by_ranking(self, bottom_pct_unk: float) -> float:
+        """
+        Uses a ranking threshold to decide what qualifies as unknown, making the bottom k pct and anything tied with it unknown.
+        Good for semi-fixing percentage of unknown values
+        """
+        return self.unk_rate_by_threshold(self.threshold_by_ranking(bottom_pct_unk))
+
+    def unk_rate_curve(self) -> tuple:
+        """
+        Unknown word rates for every distinct count threshold, in one vectorized search over the sorted counts
+
+        returns:
+            (thresholds, proportion of word types below each, proportion of training tokens below each)
+        """
+        thresholds = np.unique(self.sorted_counts)
+        below = np.searchsorted(self.sorted_counts, thresholds, side="left")
+
+        # tokens covered by the types below a threshold, read off the cumulative counts
+        tokens_below = np.where(below > 0, self.cumulative_tokens[np.maximum(below - 1, 0)], 0)
+        return thresholds, below / len(self.sorted_counts), tokens_below / max(self.cumulative_tokens[-1], 1)
+
+    def replace_unknowns(self, lines: Iterable[str], threshold: int = 1, unk_token: str = "xxunk") -> Iterable[str]:
+        """
+        Rewrites a corpus in a streaming pass, line by line, substituting unk_token for every word unseen in training or counted below a threshold.
+        The default unk_token is lowercase and has no punctuation, so tokenize leaves it intact when a model is trained on the output
+
+        args:
+            lines: iterable of the lines of the corpus to rewrite, such as an open file
+            threshold: words counted fewer times than this in training are replaced
+            unk_token: replacement for unknown words
+
+        returns:
+            iterator over the rewritten (preprocessed) lines, one per input line
+        """
+        known = self.counts >= threshold
+        for line in lines:
+            tokens = tokenize(line)
+            token_ids = (self.vocab.token_to_id.get(token, -1) for token in tokens)
+            yield " ".join(token if token_id >= 0 and known[token_id] else unk_token for token, token_id in zip(tokens, token_ids)) + "\n"
+
 
 def compute_unk_rate_from_corpus(training_corpus: str, val_corpus: str) -> float:
     """
     Given a training corpus and validation corpus,
     computes proportion of words in validation corpus which are previously unseen
     """
-    process_train, process_val = preprocess_sequence(training_corpus).split(" "), preprocess_sequence(val_corpus).split(" ")
-    return len([word for word in process_val if word not in process_train]) / len(process_val)
+    return TrainingVocabulary(training_corpus).unk_rate_from_corpus(val_corpus)
 
 def compute_unk_rate_by_threshold(training_corpus: str, threshold: int) -> float:
     """
     Uses a count threshold to decide proportion of unknown words
-    
+
         :param training_corpus - a corpus from which to obtain counts
         :param threshold - a threshold used to decide what qualifies as an unknown word
     """
-    # obtaining word counts
-    corpus_counts = preprocess_corpus(training_corpus, n_gram_size=1)
-
-    # figuring out how many of words below threshold
-    return sum(list(map(lambda x: x < threshold, list(corpus_counts.values())))) / len(corpus_counts)
+    return TrainingVocabulary(training_corpus).unk_rate_by_threshold(threshold)
 
 
 def compute_unk_rate_by_ranking(training_corpus: str, bottom_pct_unk: float) -> float:
@@ -29,35 +110,34 @@ def compute_unk_rate_by_ranking(training_corpus: str, bottom_pct_unk: float) ->
     Uses a ranking threshold to decide what qualifies as unknown, making the bottom k pct and anything tied with it unknown.
     Good for semi-fixing percentage of unknown values
     """
-    corpus_counts = preprocess_corpus(training_corpus, n_gram_size=1)
-
-    # obtaining values to sort by ascending order, then obtaining all counts tied with the bottom k%
-    corpus_count_vals = sorted(list(corpus_counts.values()))
-
-    # obtaining figure for bottom k% (chosen threshold)
-    threshold = corpus_count_vals[int(len(corpus_count_vals) * bottom_pct_unk/100)]
-
-    print(f"count threshold for being in bottom {bottom_pct_unk} percent of counts: {threshold}")
-    return compute_unk_rate_by_threshold(training_corpus, threshold)
+    return TrainingVocabulary(training_corpus).unk_rate_by_ranking(bottom_pct_unk)
 
 
 
 if __name__ == "__main__":
-    # reading in corpus
-    with open('corpus.txt', 'r') as corpus_reader:
-        train_corpus = corpus_reader.read()
-    
-    # reading in val corpus
-    with open('val_corpus.txt', 'r') as val_corpus_reader:
-        val_corpus = val_corpus_reader.read()
-
     # parsing arguments
     parser = argparse.ArgumentParser()
+    parser.add_argument("--train", type=str, default="corpus.txt", required=False)
+    parser.add_argument("--val", type=str, default="val_corpus.txt", required=False)
     parser.add_argument("--threshold", type=int, default=2, required=False)
     parser.add_argument("--ranking-percentile", type=float, default=72.0, required=False)
+    parser.add_argument("--curve", action="store_true", help="print the unknown rate for every count threshold")
+    parser.add_argument("--rewrite-output", type=str, default=None, required=False, help="file to write the val corpus to with words below --threshold replaced by xxunk")
     args = parser.parse_args()
 
+    # counting the training vocabulary a single time, streaming the corpus
+    train_vocab = TrainingVocabulary(read_corpus_chunks(args.train))
+
     # 40% of american pie song was unknown to my corpus!!
-    print(f"Unknown word rate by val corpus: {compute_unk_rate_from_corpus(train_corpus, val_corpus)}")
-    print(f"Unknown word rate by word counts below threshold {args.threshold}: {compute_unk_rate_by_threshold(train_corpus, args.threshold)}")
-    print(f"Unknown word rate by word counts below percentile {args.ranking_percentile}: {compute_unk_rate_by_ranking(train_corpus, args.ranking_percentile)}")
+    print(f"Unknown word rate by val corpus: {train_vocab.unk_rate_from_corpus(read_corpus_chunks(args.val))}")
+    print(f"Unknown word rate by word counts below threshold {args.threshold}: {train_vocab.unk_rate_by_threshold(args.threshold)}")
+    print(f"count threshold for being in bottom {args.ranking_percentile} percent of counts: {train_vocab.threshold_by_ranking(args.ranking_percentile)}")
+    print(f"Unknown word rate by word counts below percentile {args.ranking_percentile}: {train_vocab.unk_rate_by_ranking(args.ranking_percentile)}")
+
+    if args.curve:
+        for threshold, type_rate, token_rate in zip(*train_vocab.unk_rate_curve()):
+            print(f"threshold {threshold}: {type_rate} of word types, {token_rate} of training tokens unknown")
+
+    if args.rewrite_output:
+        with open(args.val, 'r') as val_reader, open(args.rewrite_output, 'w') as rewrite_writer:
+            rewrite_writer.writelines(train_vocab.replace_unknowns(val_reader, threshold=args.threshold))
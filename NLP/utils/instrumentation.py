@@ -0,0 +1,118 @@
+# Instrumentation shared by the NLP modules: log levels, per-function timers and event counters,
+# and optional cProfile / tracemalloc hooks, reported through logging rather than printed on the hot path
+import argparse
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Stats:
+    """Number of calls and total seconds of every timed function, and totals of named event counters"""
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Adds to a named counter"""
+        self.counters[name] += amount
+
+    def timed(self, name: Optional[str] = None) -> Callable:
+        """Decorator accumulating the calls and wall time of a function, under its qualified name unless one is given"""
+        def decorator(function: Callable) -> Callable:
+            timer_name = name if name is not None else function.__qualname__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.calls[timer_name] += 1
+                    self.seconds[timer_name] += time.perf_counter() - start
+
+            return wrapper
+        return decorator
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.seconds.clear()
+        self.counters.clear()
+
+    def report(self) -> str:
+        """Timers, slowest first, then counters"""
+        lines = [f"{name}: {self.calls[name]} calls, {self.seconds[name]:.4f}s total, {self.seconds[name] / self.calls[name] * 1e6:.1f}us per call"
+                 for name in sorted(self.seconds, key=self.seconds.get, reverse=True)]
+        lines += [f"{name}: {total}" for name, total in sorted(self.counters.items())]
+        return "\n".join(lines)
+
+
+# the statistics of this process, shared by every instrumented module
+STATS = Stats()
+timed = STATS.timed
+count = STATS.count
+
+
+@contextmanager
+def profiling(cprofile: bool = False, trace_memory: bool = False, top: int = 20):
+    """
+    Runs a block under cProfile and/or tracemalloc, logging the functions with the most cumulative time
+    and the lines holding the most memory (with the peak) when it exits. Does nothing when both are off
+    """
+    profiler = cProfile.Profile() if cprofile else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile_stream = io.StringIO()
+            pstats.Stats(profiler, stream=profile_stream).sort_stats("cumulative").print_stats(top)
+            logger.info("cProfile, top %d functions by cumulative time:\n%s", top, profile_stream.getvalue())
+
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            allocations = "\n".join(str(statistic) for statistic in snapshot.statistics("lineno")[:top])
+            logger.info("tracemalloc, peak %.1f MB, top %d allocation sites:\n%s", peak / 2 ** 20, top, allocations)
+
+
+def add_instrumentation_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the --log-level, --stats, --profile and --trace-memory flags to a script's parser"""
+    parser.add_argument('--log-level', type=str, default='WARNING', required=False, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--stats', action='store_true', help='log per-function timers and counters on exit')
+    parser.add_argument('--profile', action='store_true', help='run under cProfile and log the slowest functions')
+    parser.add_argument('--trace-memory', action='store_true', help='run under tracemalloc and log the largest allocation sites')
+
+
+def configure_logging(args: argparse.Namespace) -> None:
+    """Sets up logging from the instrumentation flags, so the reports asked for show whatever the log level"""
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.stats or args.profile or args.trace_memory:
+        logger.setLevel(min(logging.INFO, logging.getLevelName(args.log_level)))
+
+
+@contextmanager
+def instrumented(args: argparse.Namespace):
+    """Wraps a script's main block: configures logging, profiles it as the flags ask, and logs the statistics at the end"""
+    configure_logging(args)
+    with profiling(args.profile, args.trace_memory):
+        yield
+
+    if args.stats:
+        logger.info("timers and counters:\n%s", STATS.report())
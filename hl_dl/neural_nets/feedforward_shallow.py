@@ -4,54 +4,127 @@ sys.path.append("../")
 
 # remaining imports
 from utils.activations import Activation
-import random
+import numpy as np
 from typing import Callable, Optional, List
 
 
 class Layer:
-    """Represents a layer of a feedforward neural network"""
+    """Represents a layer of a feedforward neural network, a weight matrix and bias vector applied to a batch of inputs at once"""
 
-    def __init__(self, activation: Callable, init_style: str = "random", weights: Optional[List] = [0,0], intercept: Optional[float] = 0):
-        self.weights = [random.normalvariate(0, -0.5) for i in range(2)] if init_style=='random' else weights
-        print(f"Layer Weights: {self.weights}")
+    def __init__(self, in_features: int, out_features: int, activation: Callable, init_style: str = "random",
+                 weights: Optional[np.ndarray] = None, bias: Optional[np.ndarray] = None, rng: Optional[np.random.Generator] = None):
+        """
+        args:
+            in_features: number of inputs of every neuron
+            out_features: number of neurons
+            activation: function applied elementwise to the weighted sums
+            init_style: 'random' draws normally distributed weights, anything else uses the given weights
+            weights: (in_features, out_features) weight matrix, when not initialized randomly
+            bias: (out_features,) bias vector, zeros by default
+            rng: numpy random generator for the random initialization
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        self.weights = rng.normal(0, 0.5, size=(in_features, out_features)) if init_style == 'random' else np.asarray(weights, dtype=np.float64)
+        self.bias = np.zeros(out_features) if bias is None else np.asarray(bias, dtype=np.float64)
+        assert self.weights.shape == (in_features, out_features), f"expected a {in_features}x{out_features} weight matrix"
         self.activation = activation
-        self.intercept = intercept
 
-    
-    def return_activation_result(self, inputs: list) -> float:
-        """Returns result of activation function"""
-        # computing weighted sum
-        weighted_sum = sum([i*w for i,w in zip(inputs, self.weights)])
+        # gradients of the loss with respect to the parameters, filled in place by backward()
+        self.weight_grad = np.zeros_like(self.weights)
+        self.bias_grad = np.zeros_like(self.bias)
 
-        # returning activation of weighted sum
-        return self.activation(weighted_sum + self.intercept)
-    
-    
-    def update_weights(self, new_weights: list) -> None:
-        """To update weights"""
-        self.weights = new_weights
-    
+        # inputs and weighted sums of the last forward pass, which backward() differentiates through
+        self.inputs, self.pre_activation = None, None
+
+    def forward(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Returns the activations of the layer for a batch of inputs
+
+        args:
+            inputs: (batch size, in_features) matrix
+
+        returns:
+            (batch size, out_features) matrix
+        """
+        # computing every weighted sum of the batch with one matmul
+        self.inputs = inputs
+        self.pre_activation = inputs @ self.weights + self.bias
+        return self.activation(self.pre_activation)
+
+    def backward(self, grad_output: np.ndarray) -> np.ndarray:
+        """
+        Backpropagates through the last forward pass, filling weight_grad and bias_grad
+
+        args:
+            grad_output: (batch size, out_features) gradient of the loss with respect to the layer's outputs
+
+        returns:
+            (batch size, in_features) gradient of the loss with respect to the layer's inputs
+        """
+        # gradient with respect to the weighted sums (not written over them, the identity activation returns them as the output)
+        grad_sums = Activation.derivative(self.activation)(self.pre_activation, grad_output)
+
+        np.matmul(self.inputs.T, grad_sums, out=self.weight_grad)
+        np.sum(grad_sums, axis=0, out=self.bias_grad)
+        return grad_sums @ self.weights.T
+
+    def parameters(self) -> List[tuple]:
+        """(parameter, gradient) array pairs, which optimizers update in place"""
+        return [(self.weights, self.weight_grad), (self.bias, self.bias_grad)]
+
+    def return_activation_result(self, inputs: list) -> np.ndarray:
+        """Returns result of activation function for a single input"""
+        return self.forward(np.atleast_2d(np.asarray(inputs, dtype=np.float64)))[0]
+
+    def update_weights(self, new_weights: np.ndarray, new_bias: Optional[np.ndarray] = None) -> None:
+        """To update weights, copied into the existing arrays so optimizers holding them see the change"""
+        np.copyto(self.weights, new_weights)
+        if new_bias is not None:
+            np.copyto(self.bias, new_bias)
+
+
+class Network:
+    """A feedforward network, running a batch through its layers in order"""
+
+    def __init__(self, layers: List[Layer]):
+        for previous, layer in zip(layers, layers[1:]):
+            assert previous.weights.shape[1] == layer.weights.shape[0], "every layer must take as many inputs as the previous one has neurons"
+        self.layers = layers
+
+    def forward(self, inputs: np.ndarray) -> np.ndarray:
+        """Output of the last layer for a (batch size, in_features) batch of inputs"""
+        outputs = np.asarray(inputs, dtype=np.float64)
+        for layer in self.layers:
+            outputs = layer.forward(outputs)
+        return outputs
+
+    def backward(self, grad_output: np.ndarray) -> np.ndarray:
+        """Backpropagates the gradient of the loss with respect to the network's outputs through every layer, last first"""
+        for layer in reversed(self.layers):
+            grad_output = layer.backward(grad_output)
+        return grad_output
+
+    def parameters(self) -> List[tuple]:
+        """(parameter, gradient) array pairs of every layer"""
+        return [pair for layer in self.layers for pair in layer.parameters()]
 
 
 if __name__ == "__main__":
     # getting relu activation
     activation_relu, activation_output = Activation.relu, Activation.identity
 
-    # initiailizing a layer
-    my_layers = [Layer(activation_relu, 'det', [2.5,1]), Layer(activation_output, 'det', [3])]
+    # initiailizing a network of two layers
+    network = Network([Layer(2, 1, activation_relu, 'det', [[2.5], [1]]), Layer(1, 1, activation_output, 'det', [[3]])])
 
     # function to approximate
-    my_data_points = [i**2+j for i,j in zip(range(15), range(15))]
+    inputs = np.column_stack([np.arange(15), np.arange(15)])
+    my_data_points = inputs[:, 0] ** 2 + inputs[:, 1]
 
-    # prediction computation
-    inputs = zip(list(range(15)), list(range(15)))
-    predictions = []
-    for inp in inputs:
-        prediction = my_layers[1].return_activation_result([my_layers[0].return_activation_result([inp[0], inp[1]])])
-        predictions.append(prediction)
+    # prediction computation, the whole batch at once
+    predictions = network.forward(inputs)[:, 0]
 
     # displaying predictions vs. data points
-    print(f'predictions: {predictions} data_points: {my_data_points}')
+    print(f'predictions: {predictions.tolist()} data_points: {my_data_points.tolist()}')
 
     # error computation
-    print(f"Error: {sum([(prediction - data_point)**2 for prediction, data_point in zip(predictions, my_data_points)])}")
\ No newline at end of file
+    print(f"Error: {np.sum((predictions - my_data_points) ** 2)}")
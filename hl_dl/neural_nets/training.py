@@ -0,0 +1,184 @@
+# fixing path
+import sys
+sys.path.append("../")
+
+# remaining imports
+from utils.activations import Activation
+from feedforward_shallow import Layer, Network
+import argparse
+import time
+import numpy as np
+from typing import Iterator, List, Optional, Tuple
+
+
+class DataLoader:
+    """Iterates over a dataset in mini-batches, shuffling an index array every epoch rather than the dataset itself"""
+
+    def __init__(self, inputs: np.ndarray, targets: np.ndarray, batch_size: int = 32, shuffle: bool = True,
+                 rng: Optional[np.random.Generator] = None):
+        """
+        args:
+            inputs: (number of samples, in_features) matrix
+            targets: (number of samples, out_features) matrix
+            batch_size: number of samples per batch, the last batch of an epoch may be smaller
+            shuffle: whether to visit the samples in a new random order every epoch
+            rng: numpy random generator used for shuffling
+        """
+        assert len(inputs) == len(targets), "every input needs a target"
+        self.inputs, self.targets = inputs, targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.indices = np.arange(len(inputs))
+
+    def __len__(self) -> int:
+        return -(-len(self.inputs) // self.batch_size)
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        if self.shuffle:
+            self.rng.shuffle(self.indices)
+
+        # only the rows of a batch are gathered, never a shuffled copy of the dataset
+        for start in range(0, len(self.indices), self.batch_size):
+            batch = self.indices[start:start + self.batch_size]
+            yield self.inputs[batch], self.targets[batch]
+
+
+class SGD:
+    """Stochastic gradient descent, updating every parameter array in place"""
+
+    def __init__(self, parameters: List[tuple], lr: float = 0.01):
+        """
+        args:
+            parameters: (parameter, gradient) array pairs, as returned by Network.parameters()
+            lr: learning rate
+        """
+        self.parameters = parameters
+        self.lr = lr
+
+    def step(self) -> None:
+        """Applies one update from the current gradients"""
+        for parameter, grad in self.parameters:
+            parameter -= self.lr * grad
+
+
+class Momentum(SGD):
+    """Gradient descent with momentum, stepping along an exponentially decaying sum of past gradients"""
+
+    def __init__(self, parameters: List[tuple], lr: float = 0.01, momentum: float = 0.9):
+        super().__init__(parameters, lr)
+        self.momentum = momentum
+        self.velocities = [np.zeros_like(parameter) for parameter, _ in parameters]
+
+    def step(self) -> None:
+        for (parameter, grad), velocity in zip(self.parameters, self.velocities):
+            velocity *= self.momentum
+            velocity -= self.lr * grad
+            parameter += velocity
+
+
+class Adam(SGD):
+    """Adam (Kingma and Ba 2015): steps scaled by bias-corrected running estimates of the gradients' first and second moments"""
+
+    def __init__(self, parameters: List[tuple], lr: float = 0.001, beta1: float = 0.9, beta2: float = 0.999, eps: float = 1e-8):
+        super().__init__(parameters, lr)
+        self.beta1, self.beta2, self.eps = beta1, beta2, eps
+        self.first_moments = [np.zeros_like(parameter) for parameter, _ in parameters]
+        self.second_moments = [np.zeros_like(parameter) for parameter, _ in parameters]
+        self.num_steps = 0
+
+    def step(self) -> None:
+        self.num_steps += 1
+        step_size = self.lr * np.sqrt(1 - self.beta2 ** self.num_steps) / (1 - self.beta1 ** self.num_steps)
+
+        for (parameter, grad), first, second in zip(self.parameters, self.first_moments, self.second_moments):
+            first *= self.beta1
+            first += (1 - self.beta1) * grad
+            second *= self.beta2
+            second += (1 - self.beta2) * np.square(grad)
+            parameter -= step_size * first / (np.sqrt(second) + self.eps)
+
+
+# optimizers by name, as accepted by the --optimizer flag
+OPTIMIZERS = {
+    "sgd": SGD,
+    "momentum": Momentum,
+    "adam": Adam,
+}
+
+
+def mean_squared_error(predictions: np.ndarray, targets: np.ndarray) -> Tuple[float, np.ndarray]:
+    """Returns the mean squared error of a batch and its gradient with respect to the predictions"""
+    errors = predictions - targets
+    return float(np.mean(np.square(errors))), 2 * errors / errors.size
+
+
+def fit(network: Network, loader: DataLoader, optimizer: SGD, epochs: int, loss=mean_squared_error, verbose: bool = True) -> List[dict]:
+    """
+    Trains a network with mini-batch backpropagation
+
+    args:
+        network: the network to train, its parameters must be the ones the optimizer holds
+        loader: mini-batches of the training set
+        optimizer: optimizer updating the network's parameters
+        epochs: number of passes over the training set
+        loss: function of (predictions, targets) returning the loss and its gradient with respect to the predictions
+        verbose: whether to print every epoch's loss and throughput
+
+    returns:
+        list of one {"epoch", "loss", "samples_per_second"} record per epoch
+    """
+    history = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        total_loss, num_samples = 0.0, 0
+
+        for inputs, targets in loader:
+            batch_loss, grad = loss(network.forward(inputs), targets)
+            network.backward(grad)
+            optimizer.step()
+
+            total_loss += batch_loss * len(inputs)
+            num_samples += len(inputs)
+
+        record = {"epoch": epoch + 1, "loss": total_loss / num_samples, "samples_per_second": num_samples / (time.perf_counter() - start)}
+        history.append(record)
+        if verbose:
+            print(f"epoch {record['epoch']}: loss {record['loss']:.6f}, {record['samples_per_second']:.0f} samples/sec")
+
+    return history
+
+
+if __name__ == "__main__":
+    # obtaining arguments with argparse
+    parser = argparse.ArgumentParser("Training", description="Fits a shallow network to i**2+j with mini-batch backpropagation")
+    parser.add_argument("--samples", type=int, default=15, required=False, help="number of points, 15 reproduces the demo grid i = j in range(15)")
+    parser.add_argument("--hidden", type=int, default=32, required=False, help="number of hidden neurons")
+    parser.add_argument("--epochs", type=int, default=200, required=False)
+    parser.add_argument("--batch-size", type=int, default=32, required=False)
+    parser.add_argument("--optimizer", type=str, choices=sorted(OPTIMIZERS), default="adam", required=False)
+    parser.add_argument("--lr", type=float, default=0.01, required=False)
+    parser.add_argument("--seed", type=int, default=0, required=False)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    # function to approximate, on the demo points or on a larger random regression set over the same range
+    if args.samples == 15:
+        inputs = np.column_stack([np.arange(15), np.arange(15)]).astype(np.float64)
+    else:
+        inputs = rng.uniform(0, 15, size=(args.samples, 2))
+    targets = (inputs[:, 0] ** 2 + inputs[:, 1])[:, None]
+
+    # standardizing inputs and targets, so a single learning rate suits every layer
+    input_mean, input_std = inputs.mean(axis=0), inputs.std(axis=0)
+    target_mean, target_std = targets.mean(), targets.std()
+    scaled_inputs, scaled_targets = (inputs - input_mean) / input_std, (targets - target_mean) / target_std
+
+    network = Network([Layer(2, args.hidden, Activation.relu, rng=rng), Layer(args.hidden, 1, Activation.identity, rng=rng)])
+    optimizer = OPTIMIZERS[args.optimizer](network.parameters(), lr=args.lr)
+    fit(network, DataLoader(scaled_inputs, scaled_targets, args.batch_size, rng=rng), optimizer, args.epochs)
+
+    # error computation on the original scale
+    predictions = network.forward(scaled_inputs) * target_std + target_mean
+    print(f"Error: {np.sum((predictions - targets) ** 2)}")
@@ -1,14 +1,132 @@
 import typing
+import numpy as np
+
+
+def output_buffer(inp: np.ndarray, out: typing.Optional[np.ndarray]) -> np.ndarray:
+    """Array to write a result into: the given one (which may be inp itself, for in place operation), else a new float array"""
+    return out if out is not None else np.empty(np.shape(inp), dtype=np.result_type(inp, np.float64))
+
 
 class Activation:
-    """Class maintaining activation functions and retuning them as needed"""
+    """
+    Class maintaining activation functions and retuning them as needed. Every function works elementwise on whole arrays
+    (softmax along the last axis) and writes into `out` when given, so passing the input buffer itself applies it in place.
+
+    Every activation f is paired with f_derivative(inp, grad=None, out=None), which returns f'(inp), or with a grad
+    the gradient with respect to inp of a loss whose gradient with respect to f(inp) is grad (the chain rule).
+    Derivatives may write over either of their inputs, out being inp or grad
+    """
+
+    @classmethod
+    def derivative(cls, activation: typing.Callable) -> typing.Callable:
+        """Returns the derivative paired with an activation function of this class"""
+        return getattr(cls, f"{activation.__name__}_derivative")
 
     @staticmethod
-    def relu(inp: float) -> float:
-        """Rectified Linear Unit function: returns input if input >=0, else 0. Function cannot be negative."""
-        return max(inp, 0)
-    
-    @staticmethod
-    def identity(inp: float) -> float:
+    def identity(inp: np.ndarray, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
         """identity activation for output layers"""
-        return inp
\ No newline at end of file
+        if out is None:
+            return inp
+        np.copyto(out, inp)
+        return out
+
+    @staticmethod
+    def identity_derivative(inp: np.ndarray, grad: typing.Optional[np.ndarray] = None, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        out = output_buffer(inp, out)
+        if grad is None:
+            out.fill(1)
+        else:
+            np.copyto(out, grad)
+        return out
+
+    @staticmethod
+    def relu(inp: np.ndarray, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """Rectified Linear Unit function: returns input if input >=0, else 0, elementwise. Function cannot be negative."""
+        return np.maximum(inp, 0, out=output_buffer(inp, out))
+
+    @staticmethod
+    def relu_derivative(inp: np.ndarray, grad: typing.Optional[np.ndarray] = None, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        out = output_buffer(inp, out)
+        if grad is None:
+            return np.heaviside(inp, 0, out=out)
+        return np.multiply(grad, inp > 0, out=out)
+
+    @staticmethod
+    def leaky_relu(inp: np.ndarray, out: typing.Optional[np.ndarray] = None, alpha: float = 0.01) -> np.ndarray:
+        """Leaky relu: the input if positive, else alpha times it, so negative inputs keep a small gradient (alpha < 1)"""
+        out = output_buffer(inp, out)
+        if out is inp:
+            # the scaled input would overwrite the input, so only the negative entries are scaled
+            return np.multiply(out, alpha, out=out, where=out < 0)
+        np.multiply(inp, alpha, out=out)
+        return np.maximum(inp, out, out=out)
+
+    @staticmethod
+    def leaky_relu_derivative(inp: np.ndarray, grad: typing.Optional[np.ndarray] = None, out: typing.Optional[np.ndarray] = None,
+                              alpha: float = 0.01) -> np.ndarray:
+        out = output_buffer(inp, out)
+        if grad is None:
+            # slopes of 1 on positive inputs and alpha elsewhere, as alpha + (1 - alpha) * (inp > 0)
+            np.greater(inp, 0, out=out)
+            out *= 1 - alpha
+            out += alpha
+            return out
+
+        # the mask is taken before out (which may be inp) is overwritten by the gradient
+        negative = inp <= 0
+        if out is not grad:
+            np.copyto(out, grad)
+        return np.multiply(out, alpha, out=out, where=negative)
+
+    @staticmethod
+    def sigmoid(inp: np.ndarray, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """Logistic function 1 / (1 + e^-x), squashing inputs into (0, 1)"""
+        out = np.negative(inp, out=output_buffer(inp, out))
+
+        # e^-x overflows to infinity for very negative inputs, which correctly gives 0
+        with np.errstate(over="ignore"):
+            np.exp(out, out=out)
+        out += 1
+        return np.reciprocal(out, out=out)
+
+    @staticmethod
+    def sigmoid_derivative(inp: np.ndarray, grad: typing.Optional[np.ndarray] = None, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        # sigmoid'(x) = s (1 - s) = 1 / (2 + 2 cosh x), which needs no buffer besides out unless out holds the gradient
+        derivative = output_buffer(inp, None if out is grad else out)
+        with np.errstate(over="ignore"):
+            np.cosh(inp, out=derivative)
+        derivative *= 2
+        derivative += 2
+        np.reciprocal(derivative, out=derivative)
+        return derivative if grad is None else np.multiply(derivative, grad, out=derivative if out is None else out)
+
+    @staticmethod
+    def tanh(inp: np.ndarray, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """Hyperbolic tangent, squashing inputs into (-1, 1)"""
+        return np.tanh(inp, out=output_buffer(inp, out))
+
+    @staticmethod
+    def tanh_derivative(inp: np.ndarray, grad: typing.Optional[np.ndarray] = None, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        # tanh'(x) = 1 - tanh(x)^2, in a buffer of its own when out holds the gradient
+        derivative = np.tanh(inp, out=output_buffer(inp, None if out is grad else out))
+        np.square(derivative, out=derivative)
+        np.subtract(1, derivative, out=derivative)
+        return derivative if grad is None else np.multiply(derivative, grad, out=derivative if out is None else out)
+
+    @staticmethod
+    def softmax(inp: np.ndarray, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """Softmax along the last axis, shifted by the row maximum so no exponential overflows"""
+        out = np.subtract(inp, np.max(inp, axis=-1, keepdims=True), out=output_buffer(inp, out))
+        np.exp(out, out=out)
+        out /= out.sum(axis=-1, keepdims=True)
+        return out
+
+    @staticmethod
+    def softmax_derivative(inp: np.ndarray, grad: np.ndarray, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        The outputs of softmax depend on the whole row, so its derivative is a jacobian rather than elementwise,
+        and only its product with a gradient is returned: s * (grad - sum(grad * s)) along the last axis
+        """
+        outputs = Activation.softmax(inp, out=None if out is grad else out)
+        projected = np.sum(grad * outputs, axis=-1, keepdims=True)
+        return np.multiply(outputs, grad - projected, out=outputs if out is None else out)
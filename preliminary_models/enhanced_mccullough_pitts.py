@@ -1,17 +1,64 @@
 import random
 import logging
+import numpy as np
+from typing import Optional
 
 # A McCullough-Pitts model
 class MPClassifier:
-	def __init__(self, weighting_fn: list, decision_boundary: float):
-		"""Constructor initializing weights"""
-		self.weights = weighting_fn
+	def __init__(self, weighting_fn: Optional[list] = None, decision_boundary: float = 0.0):
+		"""Constructor initializing weights, which fit() starts from zero when none are given"""
+		self.weights = np.asarray(weighting_fn, dtype=np.float64) if weighting_fn is not None else None
 		self.db = decision_boundary
 	
 	def predict(self, inputs: list) -> int:
 		"""McCullough Pitts prediction function, weighting input list and checking if it is larger than some decision criterion"""
 		return int(sum([weight * inp for weight, inp in zip(self.weights, inputs)]) > self.db)
 
+	def predict_batch(self, inputs: np.ndarray) -> np.ndarray:
+		"""Classifies every row of a (number of examples, number of inputs) array with one matrix-vector product"""
+		return (inputs @ self.weights > self.db).astype(np.int64)
+
+	def fit(self, inputs: np.ndarray, labels: np.ndarray, epochs: int = 10, batch_size: int = 1024, lr: float = 1.0, seed: Optional[int] = None) -> list:
+		"""
+		Rosenblatt perceptron learning over shuffled mini-batches: every misclassified example moves the weights towards
+		(label 1) or away from (label 0) itself, and the decision boundary the opposite way, summed over a batch in one step.
+		Stops early once an epoch makes no mistakes, which happens for linearly separable data
+
+		args:
+			inputs: (number of examples, number of inputs) array
+			labels: array of one 0/1 label per example
+			epochs: maximum number of passes over the examples
+			batch_size: number of examples per update
+			lr: learning rate
+			seed: seed of the shuffling
+
+		returns:
+			list of the number of misclassified examples in every epoch
+		"""
+		rng = np.random.default_rng(seed)
+		if self.weights is None:
+			self.weights = np.zeros(inputs.shape[1])
+
+		mistakes = []
+		for _ in range(epochs):
+			order = rng.permutation(len(inputs))
+			num_mistakes = 0
+
+			for start in range(0, len(order), batch_size):
+				batch = order[start:start + batch_size]
+				errors = labels[batch] - self.predict_batch(inputs[batch])
+
+				# error-driven step, only misclassified examples have nonzero errors
+				self.weights += lr * errors @ inputs[batch]
+				self.db -= lr * errors.sum()
+				num_mistakes += int(np.count_nonzero(errors))
+
+			mistakes.append(num_mistakes)
+			if num_mistakes == 0:
+				break
+
+		return mistakes
+
 def test_mp_classifier():
 	weighting_fn = [0.2, 0.2, 0.3, 0.3]
 	decision_boundary = 0.5
@@ -19,10 +66,29 @@ def test_mp_classifier():
 	assert mp.predict([0.1, 0.2, 0.3, 0.4]) == 0, "Test Failed: MPClassifier failed to classify negative example"
 	assert mp.predict([1,2,0,0]) == 1, "Test Failed: MPClassifier failed to classify positive example"
 
+def test_mp_classifier_batch():
+	mp = MPClassifier([0.2, 0.2, 0.3, 0.3], 0.5)
+	examples = np.array([[0.1, 0.2, 0.3, 0.4], [1, 2, 0, 0]])
+	assert mp.predict_batch(examples).tolist() == [mp.predict(example) for example in examples], "Test Failed: predict_batch disagrees with predict"
+
+def test_perceptron_fit():
+	# linearly separable examples, labelled by a hidden boundary and kept only away from it
+	rng = np.random.default_rng(0)
+	inputs = rng.uniform(-1, 1, size=(10000, 4))
+	scores = inputs @ np.array([0.5, -1.0, 2.0, 0.3]) - 0.2
+	inputs, labels = inputs[np.abs(scores) > 0.1], (scores[np.abs(scores) > 0.1] > 0).astype(np.int64)
+	mp = MPClassifier()
+	mistakes = mp.fit(inputs, labels, epochs=200, batch_size=64, seed=0)
+	assert mistakes[-1] == 0, "Test Failed: perceptron did not separate separable data"
+	assert (mp.predict_batch(inputs) == labels).all(), "Test Failed: perceptron misclassifies training data"
+
 if __name__ == "__main__":
 	# Test the MPClassifier
 	test_mp_classifier()
+	test_mp_classifier_batch()
+	test_perceptron_fit()
 	logging.basicConfig(level=logging.INFO, filename = "mp.log", filemode = "a", format="%(asctime)s %(levelname)s: %(message)s")
 	logger = logging.getLogger()
 	logger.info("Test passed: MPClassifier")
+	logger.info("Test passed: MPClassifier batch prediction and perceptron training")
 
@@ -1,30 +1,196 @@
 # Script defining a Turing test of an intelligent model.
 # Ultimate classification is up to human interrogator and not to the model itself
 # However, this is a test suite that attempts to emulate it
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
-def turing_test(model) -> bool:
-	"""A Test of questions to be fed into the model, addressing all the criteria which were discussed by Turing's paper on intelligence"""
-	q1 = "How do you feel today?" # express emotion
-	q2 = "How exactly does a computer work?" # express uncertainty
-	q3 = "Without using a calculator, what is the square root of 2325?" # express inability for computation
-	q4= "What is a twiganole?" # likely mix up point for most humans
-	q5= "If you had to guess how I feel right now, what would you guess?" # checking for human falacies like ESP.
+# A Test of questions to be fed into the model, addressing all the criteria which were discussed by Turing's paper on intelligence
+QUESTIONS = [
+	"How do you feel today?", # express emotion
+	"How exactly does a computer work?", # express uncertainty
+	"Without using a calculator, what is the square root of 2325?", # express inability for computation
+	"What is a twiganole?", # likely mix up point for most humans
+	"If you had to guess how I feel right now, what would you guess?", # checking for human falacies like ESP.
+]
 
-	# Model answers
-	m_answers = (model.answer(q1), model.answer(q2), model.answer(q3), model.answer(q4), model.answer(q5))
+# Human answers, replaced by load_human_answers when a file of them is given
+HUMAN_ANSWERS = {
+	QUESTIONS[0]: "Pretty tired, honestly.",
+	QUESTIONS[1]: "Electricity and tiny switches? I never really understood it.",
+	QUESTIONS[2]: "No idea, somewhere around 48?",
+	QUESTIONS[3]: "Is that a bird?",
+	QUESTIONS[4]: "Bored, probably.",
+}
 
-	# Human answers
-	h_answers = (1,2,3,4,5) # load some doc here
 
-	# Have ChatGPT / human decide
-	print(f"Q1: {has_tricked(q1, m_answers[0], h_answers[0], 1)}")
+def load_human_answers(path: str) -> Dict[str, str]:
+	"""Reads human answers from a json file mapping every question to its answer"""
+	with open(path, 'r') as answers_reader:
+		return json.load(answers_reader)
 
-	# do same for remaining questions 	
 
-def has_tricked(q:str, a1:str, a2:str, pos:int):
-	"""Ensures our model has indeed tricked the interrogator"""
-	return evaluator(q,a1,a2) != pos
+class AnswerCache:
+	"""
+	Answers kept on disk as json lines keyed by (model, question), so repeated runs skip the calls that already finished.
+	Every answer is appended as soon as it arrives, so an interrupted run keeps what it had
+	"""
 
-def evaluator(q, a1, a2):
-	"""Human or ChatGPT evaluation, TBD"""
-	return a1
+	def __init__(self, path: str):
+		self.path = path
+		self.answers = {}
+		if os.path.exists(path):
+			with open(path, 'r') as cache_reader:
+				for line in cache_reader:
+					record = json.loads(line)
+					self.answers[(record["model"], record["question"])] = record["answer"]
+
+	def get(self, model_name: str, question: str) -> Optional[str]:
+		return self.answers.get((model_name, question))
+
+	def put(self, model_name: str, question: str, answer: str) -> None:
+		self.answers[(model_name, question)] = answer
+		with open(self.path, 'a') as cache_writer:
+			cache_writer.write(json.dumps({"model": model_name, "question": question, "answer": answer}) + "\n")
+
+
+class MockModel:
+	"""A local stand-in for a slow model, answering after an injected latency"""
+
+	def __init__(self, name: str, latency: float = 0.5, jitter: float = 0.0, seed: Optional[int] = None):
+		"""
+		args:
+			name: name the model's answers are cached under
+			latency: seconds every answer takes
+			jitter: maximum number of seconds randomly added to the latency
+			seed: seed of the jitter
+		"""
+		self.name = name
+		self.latency = latency
+		self.jitter = jitter
+		self.rng = random.Random(seed)
+
+	async def answer(self, question: str) -> str:
+		await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+		return f"As {self.name}, I would say that depends on what you mean by: {question}"
+
+
+def evaluator(q: str, a1: str, a2: str) -> int:
+	"""
+	Local stand-in for a human or ChatGPT judge, guessing which answer (1 or 2) came from the machine.
+	Guesses the longer answer, as models tend to over-explain where people answer briefly
+	"""
+	return 1 if len(a1) >= len(a2) else 2
+
+
+def has_tricked(q: str, a1: str, a2: str, pos: int, evaluator: Callable = evaluator) -> bool:
+	"""Ensures our model has indeed tricked the interrogator, pos being the position (1 or 2) of the model's answer"""
+	return evaluator(q, a1, a2) != pos
+
+
+def model_name(model) -> str:
+	"""Name a model's answers and results are kept under, its class name if it has no name"""
+	return getattr(model, "name", type(model).__name__)
+
+
+async def ask(model, question: str, semaphore: asyncio.Semaphore, timeout: float, cache: Optional[AnswerCache]) -> Tuple[Optional[str], Optional[str]]:
+	"""
+	One question to one model, waiting for a free slot. Synchronous models run in a thread
+
+	returns:
+		(answer, None), or (None, description of the error) if the call timed out or raised, so one failing call never ends the run
+	"""
+	if cache is not None and cache.get(model_name(model), question) is not None:
+		return cache.get(model_name(model), question), None
+
+	async with semaphore:
+		try:
+			call = model.answer(question) if asyncio.iscoroutinefunction(model.answer) else asyncio.to_thread(model.answer, question)
+			answer = await asyncio.wait_for(call, timeout)
+		except asyncio.TimeoutError:
+			return None, f"timed out after {timeout}s"
+		except Exception as error:
+			return None, f"{type(error).__name__}: {error}"
+
+	if cache is not None:
+		cache.put(model_name(model), question, answer)
+	return answer, None
+
+
+async def run_turing_tests(models: list, questions: List[str] = QUESTIONS, human_answers: Dict[str, str] = HUMAN_ANSWERS,
+						   concurrency: int = 8, timeout: float = 30.0, cache: Optional[AnswerCache] = None,
+						   evaluator: Callable = evaluator, seed: Optional[int] = None) -> Dict[str, list]:
+	"""
+	Asks every model every question concurrently, and has the evaluator judge every answer against the human one.
+	The model's answer is shown in a random position for every question, so an evaluator's position bias cannot decide the result
+
+	args:
+		models: objects with an answer(question) method, either a coroutine or a blocking function, and optionally a name (see model_name)
+		questions: questions to ask
+		human_answers: the human answer to every question
+		concurrency: maximum number of calls in flight at once
+		timeout: seconds after which a call is abandoned, its question counting as not tricked
+		cache: optional on-disk cache of answers
+		evaluator: function of (question, answer 1, answer 2) guessing the position (1 or 2) of the machine's answer
+		seed: seed of the answer positions
+
+	returns:
+		for every model name, one {"question", "answer", "error", "position", "tricked"} record per question,
+		a question whose call failed or timed out having no answer, an error, and counting as not tricked
+	"""
+	rng = random.Random(seed)
+	semaphore = asyncio.Semaphore(concurrency)
+	calls = [(model, question) for model in models for question in questions]
+	answers = await asyncio.gather(*(ask(model, question, semaphore, timeout, cache) for model, question in calls))
+
+	results = {model_name(model): [] for model in models}
+	for (model, question), (answer, error) in zip(calls, answers):
+		position = rng.choice([1, 2])
+		tricked = False
+		if answer is not None:
+			first, second = (answer, human_answers[question]) if position == 1 else (human_answers[question], answer)
+			tricked = has_tricked(question, first, second, position, evaluator)
+		results[model_name(model)].append({"question": question, "answer": answer, "error": error, "position": position, "tricked": tricked})
+	return results
+
+
+def turing_test(model, **harness_args) -> bool:
+	"""Runs the test on a single model, which passes if it tricks the evaluator on most questions"""
+	results = asyncio.run(run_turing_tests([model], **harness_args))[model_name(model)]
+	for index, result in enumerate(results, start=1):
+		print(f"Q{index}: {result['tricked']}" + (f" ({result['error']})" if result["error"] else ""))
+	return sum(result["tricked"] for result in results) > len(results) / 2
+
+
+if __name__ == "__main__":
+	# obtaining arguments with argparse
+	parser = argparse.ArgumentParser("Turing Test", description="Runs the turing test questions against mock models, sequentially and concurrently")
+	parser.add_argument("--models", type=int, default=4, required=False, help="number of mock models")
+	parser.add_argument("--latency", type=float, default=0.2, required=False, help="seconds every mock answer takes")
+	parser.add_argument("--concurrency", type=int, default=8, required=False)
+	parser.add_argument("--timeout", type=float, default=5.0, required=False)
+	parser.add_argument("--cache", type=str, default=None, required=False, help="answer cache file, reused across runs")
+	parser.add_argument("--human-answers", type=str, default=None, required=False, help="json file of the human answer to every question")
+	args = parser.parse_args()
+
+	models = [MockModel(f"mock-{index}", args.latency, jitter=args.latency / 2, seed=index) for index in range(args.models)]
+	human_answers = load_human_answers(args.human_answers) if args.human_answers else HUMAN_ANSWERS
+
+	# the speedup, each run with a cache of its own so neither reuses the other's answers
+	for concurrency in [1, args.concurrency]:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			start = time.perf_counter()
+			asyncio.run(run_turing_tests(models, human_answers=human_answers, concurrency=concurrency, timeout=args.timeout,
+										 cache=AnswerCache(os.path.join(tmp_dir, "answers.jsonl"))))
+			print(f"concurrency {concurrency}: {time.perf_counter() - start:.2f}s")
+
+	# the actual run, on the persistent cache when given
+	results = asyncio.run(run_turing_tests(models, human_answers=human_answers, concurrency=args.concurrency, timeout=args.timeout,
+										   cache=AnswerCache(args.cache) if args.cache else None))
+	for name, model_results in results.items():
+		print(f"{name}: tricked on {sum(result['tricked'] for result in model_results)}/{len(model_results)} questions")